@@ -0,0 +1,312 @@
+import os
+import re
+
+from db_main.prepared import split_template
+
+# A table access in SQLite's EXPLAIN QUERY PLAN output, e.g. `SEARCH aapl USING INDEX idx (Date>?)`
+SQLITE_PLAN_STEP_REGEX = re.compile(r"^(SCAN|SEARCH) (?:TABLE )?(\w+)(?: AS (\w+))?(.*)$")
+# Tables and their aliases in FROM / JOIN clauses, since SQLite reports aliased tables by alias
+TABLE_ALIAS_REGEX = re.compile(
+    r"\b(?:from|join)\s+`?(\w+)`?(?:\s+(?:as\s+)?(?!(?:where|join|on|group|order|limit|inner|left|right|cross|natural|using)\b)`?(\w+)`?)?",
+    re.IGNORECASE,
+)
+
+
+class MySQLBackend:
+    """Storage backend for a MySQL server reached through pymysql."""
+
+    name = "mysql"
+    placeholder = "%s"
+
+    def __init__(self, db_info):
+        """Keeps the connection settings of one `db_cred.json` entry."""
+        self.host = db_info.get("host")
+        self.user = db_info.get("user")
+        self.password = db_info.get("password")
+        self.db_name = db_info.get("db_name")
+
+    def error_types(self):
+        """Returns the exception classes raised by the driver."""
+        from pymysql import MySQLError
+        return (MySQLError,)
+
+    def connect(self):
+        """Opens a new DB-API connection."""
+        from pymysql import connect
+        return connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.db_name
+        )
+
+    def streaming_cursor(self, conn):
+        """Returns an unbuffered server-side cursor that fetches rows on demand."""
+        from pymysql.cursors import SSCursor
+        return conn.cursor(SSCursor)
+
+    def execute_template(self, cursor, sql, params):
+        """
+        Runs a template in one round trip with its values escaped and bound by pymysql. Nothing
+        is prepared on the server: pymysql only speaks the text protocol, so PREPARE would need
+        a SET of the values and an EXECUTE per query, two round trips instead of one.
+        """
+        if params:
+            # pymysql formats the query with `%`, so literal percent signs (DATE_FORMAT, LIKE) are doubled
+            sql = "%s".join(part.replace("%", "%%") for part in split_template(sql, self.placeholder))
+        cursor.execute(sql, list(params) or None)
+
+    def cancel(self, conn):
+        """Aborts the statement running on a connection with KILL QUERY from a second connection."""
+        killer = self.connect()
+        try:
+            killer.cursor().execute(f"KILL QUERY {int(conn.thread_id())}")
+        finally:
+            killer.close()
+
+    def explain(self, conn, sql, table_names):
+        """
+        Runs EXPLAIN and returns one step per table access: the table, whether it is a full
+        scan, the index used, whether no index could serve it, the optimizer's row estimate and its notes.
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"EXPLAIN {sql}")
+            names = [desc[0].lower() for desc in cursor.description]
+            steps = []
+            for row in cursor.fetchall():
+                entry = dict(zip(names, row))
+                full_scan = entry.get("type") == "ALL"
+                steps.append({
+                    "table": entry.get("table"),
+                    "full_scan": full_scan,
+                    "index": entry.get("key"),
+                    "missing_index": full_scan and not entry.get("possible_keys"),
+                    "rows": int(entry.get("rows") or 0),
+                    "extra": entry.get("extra") or "",
+                })
+            return steps
+        finally:
+            cursor.close()
+
+    def period_expression(self, granularity, column):
+        """Returns the SQL bucketing a date column into 'YYYY-MM-DD' weeks (Mondays), 'YYYY-MM' months or 'YYYY' years."""
+        return {
+            "weekly": f"DATE_FORMAT(DATE_SUB({column}, INTERVAL WEEKDAY({column}) DAY), '%Y-%m-%d')",
+            "monthly": f"DATE_FORMAT({column}, '%Y-%m')",
+            "yearly": f"DATE_FORMAT({column}, '%Y')",
+        }[granularity]
+
+    def schema_query(self, table_names=None):
+        """Returns the (sql, params) listing (table, column, data type) for the whole database."""
+        query = (
+            "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE()"
+        )
+        params = None
+        if table_names:
+            query += " AND TABLE_NAME IN (" + ", ".join([self.placeholder] * len(table_names)) + ")"
+            params = list(table_names)
+        return query + " ORDER BY TABLE_NAME, ORDINAL_POSITION", params
+
+    def primary_key_query(self, table_name):
+        """Returns the (sql, params) listing the primary key columns of a table in key order."""
+        return (
+            "SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY' "
+            "ORDER BY ORDINAL_POSITION",
+            [table_name],
+        )
+
+    def partitioned_table_statement(self, table_name, column_defs, partition_column, partitions=16):
+        """Returns a CREATE TABLE hash-partitioned on a key column so filters on it only scan one partition."""
+        return (f"CREATE TABLE IF NOT EXISTS `{table_name}` ({', '.join(column_defs)}) "
+                f"PARTITION BY KEY (`{partition_column}`) PARTITIONS {int(partitions)}")
+
+    def upsert_statement(self, table_name, columns, key_columns):
+        """Returns an INSERT that updates the non-key columns of rows whose key already exists."""
+        column_list = ", ".join([f"`{col}`" for col in columns])
+        placeholders = ", ".join([self.placeholder] * len(columns))
+        updates = ", ".join([f"`{col}` = VALUES(`{col}`)" for col in columns if col not in key_columns])
+        # VALUES() keeps the statement in the shape pymysql batches into one multi-row INSERT
+        return (f"INSERT INTO `{table_name}` ({column_list}) VALUES ({placeholders}) "
+                f"ON DUPLICATE KEY UPDATE {updates or ', '.join(f'`{col}` = `{col}`' for col in key_columns)}")
+
+    def primary_key_statements(self, table_name, column_defs, key_column):
+        """Returns the statements that add a primary key to a loaded table."""
+        return [f"ALTER TABLE `{table_name}` ADD PRIMARY KEY (`{key_column}`)"]
+
+    def widen_column_statement(self, table_name, column, sql_type):
+        """Returns an ALTER TABLE changing a column's type, e.g. BIGINT to DOUBLE for fractional values."""
+        return f"ALTER TABLE `{table_name}` MODIFY `{column}` {sql_type}"
+
+
+class SQLiteBackend:
+    """Embedded in-process backend on the standard library sqlite3 module."""
+
+    name = "sqlite"
+    placeholder = "?"
+    statement_cache_size = 256  # Compiled statements kept per connection (sqlite3's default is 128)
+
+    def __init__(self, db_info, base_dir="."):
+        """Keeps the database file of one `db_cred.json` entry; relative paths are resolved from `base_dir`."""
+        path = db_info.get("path", ":memory:")
+        self.path = path if path == ":memory:" else os.path.join(base_dir, path)
+        self.db_name = db_info.get("db_name") or db_info.get("name") or os.path.basename(self.path)
+
+    def error_types(self):
+        """Returns the exception classes raised by the driver."""
+        import sqlite3
+        return (sqlite3.Error,)
+
+    def connect(self):
+        """Opens a new DB-API connection, creating the database file if needed."""
+        import sqlite3
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        return sqlite3.connect(self.path, check_same_thread=False, cached_statements=self.statement_cache_size)
+
+    def streaming_cursor(self, conn):
+        """sqlite3 cursors already step through results lazily."""
+        return conn.cursor()
+
+    def execute_template(self, cursor, sql, params):
+        """
+        Runs a template with its values bound natively. sqlite3 compiles a statement on first
+        execution and reuses it by SQL text from the connection's statement cache, which holds
+        `statement_cache_size` statements.
+        """
+        cursor.execute(sql, list(params))
+
+    def cancel(self, conn):
+        """Aborts the statement running on a connection; safe to call from another thread."""
+        conn.interrupt()
+
+    def explain(self, conn, sql, table_names):
+        """
+        Runs EXPLAIN QUERY PLAN and returns the same steps as the MySQL backend. SQLite keeps no
+        row estimates without ANALYZE, so scans count the whole table and index searches a fraction of it.
+        """
+        known = {name.lower(): name for name in table_names}
+        aliases = {(alias or table).lower(): table.lower() for table, alias in TABLE_ALIAS_REGEX.findall(sql)}
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            steps = []
+            for detail in [row[-1] for row in cursor.fetchall()]:
+                match = SQLITE_PLAN_STEP_REGEX.match(detail)
+                table = known.get(aliases.get(match.group(2).lower(), match.group(2).lower())) if match else None
+                if table is None:
+                    # Sorts, CTE and subquery scans; the tables they read show up as steps of their own
+                    steps.append({"table": None, "full_scan": False, "index": None, "missing_index": False,
+                                  "rows": 0, "extra": detail})
+                    continue
+                rest = match.group(4)
+                index = re.search(r"INDEX (\w+)", rest)
+                total = self._table_rows(cursor, table)
+                rows = total if match.group(1) == "SCAN" else self._search_rows(cursor, table, index, rest, total)
+                steps.append({
+                    "table": table,
+                    "full_scan": match.group(1) == "SCAN",
+                    "index": index.group(1) if index else ("PRIMARY" if "PRIMARY KEY" in rest else None),
+                    "missing_index": "AUTOMATIC" in rest,
+                    "rows": rows,
+                    "extra": detail,
+                })
+            return steps
+        finally:
+            cursor.close()
+
+    def _search_rows(self, cursor, table_name, index, detail, total):
+        """
+        Rows an index search reads: one for equality on every column of a unique key, otherwise
+        the planner's own defaults of a quarter of the table for a range and a tenth for an equality.
+        """
+        conditions = re.findall(r"(\w+)([=<>]+)\?", detail)
+        if any(op != "=" for _, op in conditions):
+            return total // 4
+        if "INTEGER PRIMARY KEY" in detail:
+            return 1
+        if index:
+            cursor.execute("SELECT \"unique\", (SELECT COUNT(*) FROM pragma_index_info(name)) "
+                           "FROM pragma_index_list(?) WHERE name = ?", [table_name, index.group(1)])
+            unique, key_columns = cursor.fetchone() or (0, 0)
+        else:
+            cursor.execute("SELECT COUNT(*) FROM pragma_table_info(?) WHERE pk > 0", [table_name])
+            unique, key_columns = 1, cursor.fetchone()[0]
+        return 1 if unique and len(conditions) >= key_columns else max(1, total // 10)
+
+    def _table_rows(self, cursor, table_name):
+        """Largest rowid as a cheap row count, falling back to COUNT(*) on WITHOUT ROWID tables."""
+        import sqlite3
+        try:
+            cursor.execute(f"SELECT MAX(rowid) FROM `{table_name}`")
+        except sqlite3.OperationalError:
+            cursor.execute(f"SELECT COUNT(*) FROM `{table_name}`")
+        return int(cursor.fetchone()[0] or 0)
+
+    def period_expression(self, granularity, column):
+        """Returns the SQL bucketing a date column into 'YYYY-MM-DD' weeks (Mondays), 'YYYY-MM' months or 'YYYY' years."""
+        return {
+            "weekly": f"date({column}, 'weekday 0', '-6 days')",
+            "monthly": f"strftime('%Y-%m', {column})",
+            "yearly": f"strftime('%Y', {column})",
+        }[granularity]
+
+    def schema_query(self, table_names=None):
+        """Returns the (sql, params) listing (table, column, data type) for the whole database."""
+        query = (
+            "SELECT m.name, p.name, lower(p.type) FROM sqlite_master AS m "
+            "JOIN pragma_table_info(m.name) AS p "
+            "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'"
+        )
+        params = None
+        if table_names:
+            query += " AND m.name IN (" + ", ".join([self.placeholder] * len(table_names)) + ")"
+            params = list(table_names)
+        return query + " ORDER BY m.name, p.cid", params
+
+    def primary_key_query(self, table_name):
+        """Returns the (sql, params) listing the primary key columns of a table in key order."""
+        return "SELECT name FROM pragma_table_info(?) WHERE pk > 0 ORDER BY pk", [table_name]
+
+    def partitioned_table_statement(self, table_name, column_defs, partition_column, partitions=16):
+        """SQLite has no partitions; a WITHOUT ROWID table is clustered on its primary key, which leads with the column."""
+        return f"CREATE TABLE IF NOT EXISTS `{table_name}` ({', '.join(column_defs)}) WITHOUT ROWID"
+
+    def upsert_statement(self, table_name, columns, key_columns):
+        """Returns an INSERT that updates the non-key columns of rows whose key already exists."""
+        column_list = ", ".join([f"`{col}`" for col in columns])
+        placeholders = ", ".join([self.placeholder] * len(columns))
+        updates = ", ".join([f"`{col}` = excluded.`{col}`" for col in columns if col not in key_columns])
+        conflict = ", ".join([f"`{col}`" for col in key_columns])
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        return f"INSERT INTO `{table_name}` ({column_list}) VALUES ({placeholders}) ON CONFLICT ({conflict}) {action}"
+
+    def primary_key_statements(self, table_name, column_defs, key_column):
+        """SQLite cannot add a primary key to a table, so the rows are copied into a keyed one that takes its name."""
+        keyed = f"{table_name}__keyed"
+        return [f"CREATE TABLE `{keyed}` ({', '.join(column_defs)}, PRIMARY KEY (`{key_column}`))",
+                f"INSERT INTO `{keyed}` SELECT * FROM `{table_name}`",
+                f"DROP TABLE `{table_name}`",
+                f"ALTER TABLE `{keyed}` RENAME TO `{table_name}`"]
+
+    def widen_column_statement(self, table_name, column, sql_type):
+        """SQLite cannot alter a column's type, and needs not: INTEGER affinity keeps fractional values as REAL."""
+        return None
+
+
+BACKENDS = {
+    "mysql": MySQLBackend,
+    "sqlite": SQLiteBackend,
+}
+
+
+def create_backend(db_info, base_dir="."):
+    """Builds the backend named by the `backend` key of a credentials entry (MySQL by default)."""
+    kind = db_info.get("backend", "mysql").lower()
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown backend '{kind}'. Expected one of: {', '.join(BACKENDS)}.")
+    if kind == "sqlite":
+        return SQLiteBackend(db_info, base_dir)
+    return BACKENDS[kind](db_info)
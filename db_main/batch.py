@@ -0,0 +1,126 @@
+import contextlib
+import csv
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_main.cache import ResultCache
+from db_main.db_setup import ChatDB
+from db_main.prepared import inline_params
+
+
+def read_records(source):
+    """
+    Yields {"table": ..., "question": ...} records from a file path or `-` for stdin.
+
+    `.csv` files need `table` and `question` header columns; anything else is read
+    as JSON lines. Blank lines are skipped.
+    """
+    file = sys.stdin if source == "-" else open(source, "r", encoding="utf-8", newline="")
+    try:
+        if source.lower().endswith(".csv"):
+            for row in csv.DictReader(file):
+                yield {"table": row["table"].strip(), "question": row["question"].strip()}
+        else:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    yield {"table": record["table"], "question": record["question"]}
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+class BatchRunner:
+    """Translates (and optionally executes) NL questions on a thread pool with one ChatDB per worker."""
+
+    def __init__(self, cred_json, db_index, execute=False, workers=4, max_rows=100):
+        """Keeps the run settings; connections are opened lazily by each worker thread."""
+        self.cred_json = cred_json
+        self.db_index = db_index
+        self.execute = execute
+        self.workers = workers
+        self.max_rows = max_rows
+        self.result_cache = ResultCache()  # Shared by the workers' connections
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _chatdb(self):
+        """Returns the calling worker's own ChatDB, connecting on first use."""
+        chatdb = getattr(self._local, "chatdb", None)
+        if chatdb is None:
+            chatdb = self._local.chatdb = ChatDB(self.cred_json, self.db_index, result_cache=self.result_cache)
+            chatdb.debug = False
+            with self._lock:
+                self._connections.append(chatdb)
+        return chatdb
+
+    def process(self, record):
+        """Translates one record and, if enabled, executes the generated template with its values bound."""
+        result = {"table": record["table"], "question": record["question"], "sql": None, "error": None}
+        chatdb = self._chatdb()
+        if not chatdb.conn:
+            result["error"] = "No active database connection."
+            return result
+
+        start = time.perf_counter()
+        columns = chatdb.catalog.columns(record["table"])
+        if not columns:
+            result["error"] = f"Unknown table '{record['table']}'."
+            return result
+        sql_query, params = chatdb.natural_language_to_template(record["question"], record["table"], columns)
+        result["translate_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        if not sql_query.upper().startswith("SELECT"):
+            result["error"] = sql_query
+            return result
+        result["sql"] = inline_params(sql_query, params, chatdb.backend.placeholder)
+
+        if self.execute:
+            start = time.perf_counter()
+            try:
+                # The guarded path: rollup routing, result cache, cost guard and a pushed-down LIMIT
+                columns, rows = chatdb.fetch_query(sql_query, self.max_rows, params)
+                result["columns"] = columns
+                result["rows"] = [list(row) for row in rows[:self.max_rows]]
+                result["plan"] = chatdb.last_plan
+            except chatdb.backend.error_types() + (ValueError,) as e:
+                result["error"] = str(e)
+            result["execute_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return result
+
+    def run(self, records, output):
+        """Processes all records and writes one JSON line per result to `output`; returns a summary."""
+        summary = {"questions": 0, "translated": 0, "errors": 0}
+        start = time.perf_counter()
+        try:
+            # Connect once up front so an embedded database is seeded before the workers open it
+            self._chatdb()
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for result in executor.map(self.process, records):
+                    summary["questions"] += 1
+                    summary["translated"] += result["sql"] is not None
+                    summary["errors"] += result["error"] is not None
+                    output.write(json.dumps(result, default=str) + "\n")
+        finally:
+            for chatdb in self._connections:
+                chatdb.close_connection()
+        summary["seconds"] = round(time.perf_counter() - start, 3)
+        summary["questions_per_sec"] = round(summary["questions"] / summary["seconds"], 1) if summary["seconds"] else None
+        return summary
+
+
+def run_batch(cred_json, db_index, source, output_path="-", execute=False, workers=4, max_rows=100):
+    """Runs a batch file end to end; ChatDB's console messages go to stderr so stdout stays JSON."""
+    runner = BatchRunner(cred_json, db_index, execute=execute, workers=workers, max_rows=max_rows)
+    output = sys.stdout if output_path == "-" else open(output_path, "w", encoding="utf-8")
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            summary = runner.run(read_records(source), output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Batch finished: {json.dumps(summary)}", file=sys.stderr)
+    return summary
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+
+# Tables read by a query, and tables modified by a write statement
+READ_TABLES_REGEX = re.compile(r"\b(?:from|join)\s+`?(\w+)`?", re.IGNORECASE)
+WRITE_TABLES_REGEX = re.compile(
+    r"^\s*(?:insert\s+(?:ignore\s+)?into|replace\s+into|update|delete\s+from|drop\s+table(?:\s+if\s+exists)?"
+    r"|alter\s+table|truncate(?:\s+table)?|create\s+table(?:\s+if\s+not\s+exists)?)\s+`?(\w+)`?",
+    re.IGNORECASE,
+)
+QUOTED_OR_SPACE_REGEX = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\")|\s+")
+
+
+def normalize_sql(sql):
+    """Collapses whitespace and lowercases everything outside quoted literals, without a trailing `;`."""
+    parts = []
+    last = 0
+    sql = sql.strip().rstrip(";").strip()
+    for match in QUOTED_OR_SPACE_REGEX.finditer(sql):
+        parts.append(sql[last:match.start()].lower())
+        parts.append(match.group(1) if match.group(1) else " ")
+        last = match.end()
+    parts.append(sql[last:].lower())
+    return "".join(parts)
+
+
+def is_cacheable(sql):
+    """Only read-only SELECT (or WITH ... SELECT) statements are cached."""
+    return re.match(r"\s*(?:select|with)\b", sql, re.IGNORECASE) is not None
+
+
+def read_tables(sql):
+    """Returns the lowercase names of the tables a query reads."""
+    return {name.lower() for name in READ_TABLES_REGEX.findall(sql)}
+
+
+def written_table(sql):
+    """Returns the lowercase name of the table a write statement modifies, or None."""
+    match = WRITE_TABLES_REGEX.match(sql)
+    return match.group(1).lower() if match else None
+
+
+class ResultCache:
+    """
+    LRU cache of query results keyed by database index and normalized SQL, with optional disk spill.
+
+    Public methods hold a lock, so one cache can be shared by ChatDB instances on several threads.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, spill_dir=None, max_spill_bytes=1024 * 1024 * 1024):
+        """Keeps up to `max_bytes` of pickled results in memory and evicted ones in `spill_dir`."""
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self._memory = OrderedDict()  # key -> pickled (columns, rows)
+        self._spilled = OrderedDict()  # key -> (path, size)
+        self._tables = {}  # key -> tables read by the query
+        self._memory_bytes = 0
+        self._spill_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, db_index, sql):
+        """Returns the cached (columns, rows) for a query, or None on a miss."""
+        key = (db_index, normalize_sql(sql))
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+            elif key in self._spilled:
+                blob = self._unspill(key)
+            if blob is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return pickle.loads(blob)
+
+    def put(self, db_index, sql, columns, rows):
+        """Caches a query result unless it alone exceeds the memory budget."""
+        blob = pickle.dumps((list(columns), list(rows)), protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        key = (db_index, normalize_sql(sql))
+        with self._lock:
+            self._discard(key)
+            self._tables[key] = read_tables(key[1])
+            self._store(key, blob)
+
+    def invalidate_table(self, db_index, table_name):
+        """Drops every cached result of a database that reads the given table."""
+        table_name = table_name.lower()
+        with self._lock:
+            for key in [key for key, tables in self._tables.items() if key[0] == db_index and table_name in tables]:
+                self._discard(key)
+
+    def clear(self):
+        """Drops every cached result."""
+        with self._lock:
+            for key in list(self._tables):
+                self._discard(key)
+
+    def stats(self):
+        """Returns hit/miss counters and current usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "spilled_entries": len(self._spilled),
+                "spilled_bytes": self._spill_bytes,
+            }
+
+    def _store(self, key, blob):
+        """Adds a blob to memory, evicting the least recently used entries beyond the budget."""
+        self._memory[key] = blob
+        self._memory_bytes += len(blob)
+        while self._memory_bytes > self.max_bytes:
+            old_key, old_blob = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_blob)
+            self.evictions += 1
+            if not self._spill(old_key, old_blob):
+                self._tables.pop(old_key, None)
+
+    def _spill(self, key, blob):
+        """Writes an evicted blob to the spill directory; returns False when spilling is disabled."""
+        if not self.spill_dir or len(blob) > self.max_spill_bytes:
+            return False
+        path = os.path.join(self.spill_dir, hashlib.sha1(repr(key).encode()).hexdigest() + ".pkl")
+        try:
+            with open(path, "wb") as file:
+                file.write(blob)
+        except OSError:
+            return False
+        self._spilled[key] = (path, len(blob))
+        self._spill_bytes += len(blob)
+        while self._spill_bytes > self.max_spill_bytes:
+            old_key, (old_path, old_size) = self._spilled.popitem(last=False)
+            self._spill_bytes -= old_size
+            self._tables.pop(old_key, None)
+            self._remove_file(old_path)
+        return True
+
+    def _unspill(self, key):
+        """Moves a spilled blob back into memory; returns None if the file is gone."""
+        path, size = self._spilled.pop(key)
+        self._spill_bytes -= size
+        try:
+            with open(path, "rb") as file:
+                blob = file.read()
+        except OSError:
+            self._tables.pop(key, None)
+            return None
+        self._remove_file(path)
+        self._store(key, blob)
+        return blob
+
+    def _discard(self, key):
+        """Removes one key from memory, disk and the table index."""
+        blob = self._memory.pop(key, None)
+        if blob is not None:
+            self._memory_bytes -= len(blob)
+        if key in self._spilled:
+            path, size = self._spilled.pop(key)
+            self._spill_bytes -= size
+            self._remove_file(path)
+        self._tables.pop(key, None)
+
+    def _remove_file(self, path):
+        """Deletes a spill file, ignoring files that are already gone."""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,68 @@
+import time
+
+from db_main.instrument import instrumentation
+from db_main.stats import INTERNAL_TABLE_PREFIX
+
+
+class SchemaCatalog:
+    """In-memory cache of the tables, columns and column types of the connected database."""
+
+    def __init__(self, conn, backend, ttl=300):
+        """Creates an empty catalog; the schema is loaded on first use and kept for `ttl` seconds."""
+        self.conn = conn
+        self.backend = backend
+        self.ttl = ttl
+        self._tables = {}
+        self._stale = set()
+        self._loaded_at = None
+
+    def tables(self):
+        """Returns the table names in the database, without ChatDB's internal tables."""
+        self._ensure_fresh()
+        return sorted(table for table in self._tables if not table.startswith(INTERNAL_TABLE_PREFIX))
+
+    def has_table(self, table_name):
+        """Checks whether a table exists."""
+        self._ensure_fresh()
+        return table_name in self._tables
+
+    def columns(self, table_name):
+        """Returns the column names of a table in their declared order."""
+        return [name for name, _ in self.column_types(table_name)]
+
+    def column_types(self, table_name):
+        """Returns (column, data type) pairs for a table, or an empty list if it does not exist."""
+        self._ensure_fresh()
+        return list(self._tables.get(table_name, []))
+
+    def invalidate(self, table_name=None):
+        """Marks one table as stale, or the whole catalog when no table is given."""
+        if table_name is None:
+            self._loaded_at = None
+        else:
+            self._stale.add(table_name)
+
+    def _ensure_fresh(self):
+        """Reloads the whole schema when the TTL has expired, otherwise only the stale tables."""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._tables = self._load()
+            self._stale.clear()
+            self._loaded_at = time.monotonic()
+        elif self._stale:
+            stale = sorted(self._stale)
+            for table_name in stale:
+                self._tables.pop(table_name, None)
+            self._tables.update(self._load(stale))
+            self._stale.clear()
+
+    def _load(self, table_names=None):
+        """Loads column metadata with a single query against the backend's schema tables."""
+        query, params = self.backend.schema_query(table_names)
+        with instrumentation.stage("schema_lookup"):
+            cursor = self.conn.cursor()
+            cursor.execute(query, params or ())
+            rows = cursor.fetchall()
+        tables = {}
+        for table_name, column_name, data_type in rows:
+            tables.setdefault(table_name, []).append((column_name, data_type))
+        return tables
@@ -1,33 +1,112 @@
-from pymysql import connect, MySQLError
+import os
+import io
 import re
+import csv
 import json
-import pandas as pd
+import time
 import random
-import nltk
-# from nltk.tokenize import word_tokenize
-# from nltk import pos_tag
-from nltk.corpus import wordnet
-# from nltk.corpus import stopwords
-# from nltk.stem import WordNetLemmatizer
+from db_main.backends import create_backend
+from db_main.cache import ResultCache, is_cacheable, written_table
+from db_main.catalog import SchemaCatalog
+from db_main.facts import FACT_TABLE, TICKER_COLUMN, TICKER_WORDS, fact_sync_statements, fact_table_statement
+from db_main.frames import csv_dtypes, format_bytes, frame_from_batches, frame_memory, frame_rows, parse_integers
+from db_main.guard import QueryGuard, QueryRefused, format_plan
+from db_main.instrument import instrumentation
+from db_main.prepared import inline_params, sql_literal
+from db_main.resolver import ColumnResolver
+from db_main.stats import (FROM_REGEX, STATS_TABLE, ColumnStats, TableStats, column_kind, delete_table_stats,
+                            load_table_stats, save_table_stats)
+from db_main.rollups import (AGGREGATE_QUERY_REGEX, BUCKET_WORDS, GRANULARITIES, build_rollup_statements,
+                             rollup_columns, rollup_table_name, route_to_rollup)
 
-# nltk.download('punkt')
-nltk.download('wordnet')
-# nltk.download('omw-1.4') 
-# nltk.download('stopwords')
+# Heavy dependencies (pymysql, pandas) are imported inside the methods that
+# need them so the CLI starts fast and never touches the network at import time.
+
+DATE_REGEX = r"\d{4}-\d{2}-\d{2}"
+
+
+def table_name_from_file(file_path):
+    """Derives a table name from a CSV file name, e.g. `aapl` from `aapl_stock_price.csv`."""
+    stem = os.path.splitext(os.path.basename(file_path))[0].lower()
+    stem = re.sub(r"_stock_price$", "", stem)
+    return re.sub(r"\W+", "_", stem).strip("_")
 
-print("\n----------------------------CHATDB 95 – QUERYING HISTORICAL STOCK DATA----------------------------\n")
 
 class ChatDB:
-    def __init__(self, cred_json, db_index):
-        """Initializes the ChatDB class and establishes a database connection."""
+    # Phrases normalized by _preprocess_question, mapped to their replacement
+    PHRASE_REPLACEMENTS = {
+        "broken down by": "by",
+        "total": "total",
+        "sum": "total",
+        "aggregate": "total",
+        "average": "average",
+        "mean": "average",
+        "avg": "average",
+        "count": "count",
+        "the number of": "count",
+        "how many": "count"
+    }
+
+    # Aggregation keywords in priority order, mapped to their SQL function
+    AGGREGATION_FUNCTIONS = {
+        "sum": "SUM",
+        "total": "SUM",
+        "avg": "AVG",
+        "average": "AVG",
+        "mean": "AVG",
+        "count": "COUNT",
+        "the number of": "COUNT",
+        "max": "MAX",
+        "maximum": "MAX",
+        "greatest": "MAX",
+        "largest": "MAX",
+        "top": "MAX",
+        "min": "MIN",
+        "minimum": "MIN",
+        "least": "MIN",
+        "bottom": "MIN"
+    }
+
+    # Words around the table and column of a window question (moving average, return, drawdown)
+    SERIES_FILLER_WORDS = [
+        "what", "is", "are", "was", "the", "a", "an", "show", "me", "get", "find", "compute", "calculate", "give",
+        "of", "for", "on", "in", "over", "with", "daily", "trading", "day", "days", "row", "rows", "period", "periods",
+        "session", "sessions", "moving", "rolling", "average", "return", "returns", "drawdown", "drawdowns",
+        "max", "maximum", "largest", "worst", "biggest", "percent", "percentage", "price", "prices", "stock",
+    ]
+
+    def __init__(self, cred_json, db_index, schema_ttl=300, result_cache=None, cache_max_rows=10000, guard=None):
+        """
+        Initializes the ChatDB class and establishes a database connection.
+
+        Query results of up to `cache_max_rows` rows are kept in `result_cache`, which may be
+        shared between instances; a private cache is created when none is given. Exported
+        results are read from the cache but never added to it.
+        SELECTs pass the cost `guard`, built from the entry's `guard` settings when none is given.
+        """
         self.conn = None
+        self.db_index = db_index
+        self.backend = None
+        self.catalog = None
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self.cache_max_rows = cache_max_rows
+        self.guard = guard or QueryGuard()
+        self.last_plan = None  # Plan summary of the last query the guard reviewed
+        self._table_stats = {}  # Column statistics by table, loaded on first use
+        self._resolvers = {}
+        self.debug = True  # Print the [DEBUG] trace of natural_language_to_sql
+        # Tested in order: the aggregate form comes first so that e.g. "average return by month" stays an aggregate
         self.query_patterns = {
             #"<A>": self._aggregate_by_query,
             "<A> by <B>": self._aggregate_by_query,
+            "moving average": self._moving_average_query,
+            "rolling average": self._moving_average_query,
+            "return": self._return_query,
+            "drawdown": self._drawdown_query,
             "find <A> where <B> is <C>": self._find_where_query
 
         }
-
+        self._compile_translation_engine()
 
         try:
             # Load credentials from the JSON file
@@ -37,63 +116,511 @@ class ChatDB:
                 if not databases or db_index >= len(databases):
                     raise ValueError("Invalid database index or empty database configuration.")
             
-            # Extract credentials
+            # Extract credentials; relative paths in the entry are resolved from the file's directory
             db_info = databases[db_index]
-            host = db_info.get("host")
-            user = db_info.get("user")
-            password = db_info.get("password")
-            db_name = db_info.get("db_name")
-            # db_name_display = db_info.get("name", "Unknown Database")
-
-            self.conn = connect(
-                host=host, 
-                user=user, 
-                password=password, 
-                database=db_name
-            )
-            # print(f"Connected to {db_name_display} successfully")
-            print(f"Connected to {db_name} successfully")
+            base_dir = os.path.dirname(os.path.abspath(cred_json))
+            self.backend = create_backend(db_info, base_dir)
+            if guard is None:
+                self.guard = QueryGuard.from_config(db_info.get("guard"))
+            try:
+                with instrumentation.stage("connection"):
+                    self.conn = self.backend.connect()
+            except self.backend.error_types() as e:
+                print(f"The error '{e}' occurred")
+                return
+            self.catalog = SchemaCatalog(self.conn, self.backend, ttl=schema_ttl)
+            print(f"Connected to {self.backend.db_name} successfully")
+
+            # Embedded databases can be seeded from a directory of CSVs
+            if db_info.get("data_dir"):
+                self.load_data_directory(os.path.join(base_dir, db_info["data_dir"]))
         except FileNotFoundError as e:
             print(f"The file '{cred_json}' was not found.")
         except json.JSONDecodeError:
             print(f"Error decoding JSON from file '{cred_json}'.")
-        except MySQLError as e:
-            print(f"The error '{e}' occurred")
         except ValueError as e:
             print(f"Configuration error: {e}")
+
+    def load_data_directory(self, data_dir):
+        """Uploads every CSV in a directory whose table does not exist yet."""
+        if not os.path.isdir(data_dir):
+            print(f"Data directory '{data_dir}' was not found.")
+            return
+        for file_name in sorted(os.listdir(data_dir)):
+            if not file_name.lower().endswith(".csv"):
+                continue
+            table_name = table_name_from_file(file_name)
+            if not self.catalog.has_table(table_name):
+                self.upload_dataset(os.path.join(data_dir, file_name), table_name, if_exists="cancel")
     
-    def upload_dataset(self, file_path, table_name):
-        """Uploads a CSV dataset to the specified table in the database."""
+    def upload_dataset(self, file_path, table_name, chunk_size=10000, batch_size=1000, commit_every=50000,
+                       sample_rows=1000, index_columns=None, if_exists=None, rollups=False, facts=False):
+        """
+        Uploads a CSV dataset to the specified table in the database.
+
+        The CSV is streamed in chunks of `chunk_size` rows so memory stays flat,
+        each chunk is written with multi-row INSERTs of `batch_size` rows, and
+        the transaction is committed every `commit_every` rows. Column types are
+        inferred from the first `sample_rows` rows. A new table is keyed on
+        `Date` once loaded, if every row has a distinct one, and `index_columns`
+        adds secondary indexes. Chunks are parsed with dtypes
+        declared from the column types instead of being inferred again per chunk.
+
+        When the table exists, `if_exists` decides what happens (the user is asked
+        when it is None): "overwrite" drops and recreates the table, "append" only
+        loads the CSV rows dated after the table's latest `Date` and upserts them on
+        the primary key, and "cancel" leaves the table alone. With `rollups`, or when
+        the table already has rollups, they are rebuilt (only the affected periods
+        after an append). With `facts`, or when the unified `prices` table exists,
+        the uploaded rows are copied into it under the table's name as ticker.
+        Column statistics are gathered from the same chunks and stored (see `analyze_table`).
+        Returns the number of rows written, or None when nothing was uploaded.
+        """
         if not self.conn:
             print("No active database connection.")
             return
+        import pandas as pd
         try:
-            # Read the CSV file with pandas
-            df = pd.read_csv(file_path)
-
             # Check if the table exists
             cursor = self.conn.cursor()
-            cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-            table_exists = cursor.fetchone()
-
+            table_exists = self.catalog.has_table(table_name)
+            since = None
             if table_exists:
-                overwrite = input(f"Table '{table_name}' already exists. Overwrite? (y/n): ").lower()
-                if overwrite != "y":
+                if if_exists is None:
+                    answer = input(f"Table '{table_name}' already exists. (o)verwrite, (a)ppend new rows or (c)ancel? ")
+                    if_exists = {"o": "overwrite", "a": "append"}.get(answer.strip().lower()[:1], "cancel")
+                if if_exists == "overwrite":
+                    cursor.execute(f"DROP TABLE `{table_name}`")
+                    self.catalog.invalidate(table_name)
+                    table_exists = False
+                elif if_exists == "append":
+                    since = self._max_date(table_name)
+                else:
                     print("Upload canceled.")
                     return
 
-            # Create a table structure based on the DataFrame
-            columns = ", ".join([f"`{col}` TEXT" for col in df.columns])
-            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns})")
+            # Stream the CSV file with pandas instead of loading it whole; an append only parses the new lines
+            source = file_path
+            if since is not None:
+                source, skipped = self._lines_after(file_path, self._date_column(self.catalog.column_types(table_name)), since)
+                print(f"Skipped {skipped} rows dated on or before {since}.")
+            sample = pd.read_csv(source, nrows=sample_rows)
+            if sample.empty:
+                print(f"No new rows found in '{file_path}'." if since is not None else f"No rows found in '{file_path}'.")
+                return
+            if since is not None:
+                source.seek(0)
+
+            # Create a typed table structure inferred from a sample of the CSV
+            columns = list(sample.columns)
+            if table_exists:
+                column_types = dict(self.catalog.column_types(table_name))
+            else:
+                column_types = self._infer_column_types(sample)
+                self._create_typed_table(cursor, table_name, column_types)
+                self.catalog.invalidate(table_name)
+            chunks = pd.read_csv(source, chunksize=chunk_size, dtype=csv_dtypes(column_types, columns))
 
-            # Insert data row by row
-            for _, row in df.iterrows():
-                values = "', '".join([str(value).replace("'", "''") for value in row])
-                cursor.execute(f"INSERT INTO {table_name} VALUES ('{values}')")
+            # Insert data chunk by chunk with batched multi-row INSERTs, upserting on the key when appending
+            insert_sql = self._insert_statement(table_name, columns)
+            if since is not None:
+                key_columns = self._primary_key(table_name)
+                if key_columns:
+                    insert_sql = self.backend.upsert_statement(table_name, columns, key_columns)
+            # An append extends the stored statistics; without any, they are left for analyze_table
+            table_stats = TableStats(table_name) if since is None else self.column_stats(table_name)
+            integer_columns = [col for col in columns if "int" in (column_types.get(col) or "").lower()]
+            widened = set()
+            start = time.perf_counter()
+            total_rows = 0
+            uncommitted = 0
+            for chunk in chunks:
+                self._parse_integers(cursor, table_name, chunk, integer_columns, widened)
+                if table_stats is not None:
+                    table_stats.update(chunk)
+                rows = self._chunk_rows(chunk)
+                self._insert_rows(cursor, insert_sql, rows, batch_size)
+                total_rows += len(rows)
+                uncommitted += len(rows)
+                if uncommitted >= commit_every:
+                    self.conn.commit()
+                    uncommitted = 0
+            if not table_exists:
+                self._index_typed_table(cursor, table_name, column_types, index_columns)
+                self.catalog.invalidate(table_name)
             self.conn.commit()
+            self.result_cache.invalidate_table(self.db_index, table_name)
+            if table_stats is not None:
+                self._save_column_stats(table_stats)
+
+            elapsed = time.perf_counter() - start
+            rate = total_rows / elapsed if elapsed > 0 else float("inf")
             print(f"Dataset uploaded successfully to table '{table_name}'.")
+            print(f"Inserted {total_rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec).")
+            if self._rollups_of(table_name):
+                # Rollups that cannot be refreshed are rebuilt in full, or dropped rather than left stale
+                if not self.build_rollups(table_name, since=since):
+                    self._table_changed(table_name)
+            elif rollups:
+                self.build_rollups(table_name)
+            if table_name != FACT_TABLE and (facts or self.catalog.has_table(FACT_TABLE)):
+                self.sync_fact_table(table_name, since=since)
+            return total_rows
         except Exception as e:
+            self.conn.rollback()
             print(f"An error occurred: {e}")
+            # Chunks committed before the error changed the table
+            if self.catalog.has_table(table_name):
+                self._table_changed(table_name)
+
+    def _max_date(self, table_name):
+        """Returns the latest `Date` of a table as 'YYYY-MM-DD', or None when it has no rows."""
+        date_column = self._date_column(self.catalog.column_types(table_name))
+        if not date_column:
+            raise ValueError(f"Table '{table_name}' has no DATE column to append after.")
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT MAX(`{date_column}`) FROM `{table_name}`")
+        latest = cursor.fetchone()[0]
+        return str(latest)[:10] if latest is not None else None
+
+    def _primary_key(self, table_name):
+        """Returns the primary key columns of a table."""
+        query, params = self.backend.primary_key_query(table_name)
+        cursor = self.conn.cursor()
+        cursor.execute(query, params)
+        return [row[0] for row in cursor.fetchall()]
+
+    def _lines_after(self, file_path, date_column, since):
+        """
+        Returns the header and the CSV lines dated after `since` as a text buffer, plus the
+        number of lines skipped. Dates are compared as raw 'YYYY-MM-DD' prefixes, so the
+        skipped lines are never parsed.
+        """
+        with open(file_path, "r", newline="") as file:
+            header = file.readline()
+            position = [col.strip() for col in next(csv.reader([header]))].index(date_column)
+            kept = [header]
+            skipped = 0
+            for line in file:
+                if not line.strip():
+                    continue
+                if line.split(",", position + 1)[position].strip().strip('"')[:10] > since:
+                    kept.append(line)
+                else:
+                    skipped += 1
+        return io.StringIO("".join(kept)), skipped
+
+    def build_rollups(self, table_name, since=None):
+        """
+        (Re)builds the weekly, monthly and yearly OHLCV rollup tables of a table keyed by Date.
+
+        With `since`, existing rollups are refreshed from the period containing that date onward.
+        """
+        if not self.conn:
+            print("No active database connection.")
+            return False
+        column_types = self.catalog.column_types(table_name)
+        date_column = self._date_column(column_types)
+        price_columns = rollup_columns([col for col, _ in column_types])
+        if not date_column or not price_columns:
+            print(f"Table '{table_name}' needs a DATE column and price columns to build rollups.")
+            return False
+        try:
+            cursor = self.conn.cursor()
+            where = f" WHERE `{date_column}` >= '{since}'" if since else ""
+            cursor.execute(f"SELECT COUNT(*) - COUNT(DISTINCT `{date_column}`) FROM `{table_name}`{where}")
+            if cursor.fetchone()[0]:
+                print(f"Rollups need one row per date, but '{table_name}' has duplicate dates.")
+                return False
+            for granularity in GRANULARITIES:
+                for statement in build_rollup_statements(self.backend, table_name, granularity, date_column,
+                                                         price_columns, since):
+                    cursor.execute(statement)
+                rollup = rollup_table_name(table_name, granularity)
+                self.catalog.invalidate(rollup)
+                self.result_cache.invalidate_table(self.db_index, rollup)
+            self.conn.commit()
+            print(f"Rollups of '{table_name}' rebuilt: " + ", ".join(rollup_table_name(table_name, g) for g in GRANULARITIES))
+            return True
+        except self.backend.error_types() as e:
+            self.conn.rollback()
+            print(f"The error '{e}' occurred")
+            return False
+
+    def sync_fact_table(self, table_name=None, since=None):
+        """
+        Copies a ticker table's rows into the unified `prices` table (keyed by ticker and Date),
+        creating it if needed. Without `table_name` every table with a Date key and price
+        columns is copied; with `since`, only rows dated after it are replaced.
+        """
+        if not self.conn:
+            print("No active database connection.")
+            return False
+        tables = [table_name] if table_name else [table for table in self.catalog.tables() if table != FACT_TABLE]
+        synced = []
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(fact_table_statement(self.backend))
+            for table in tables:
+                column_types = self.catalog.column_types(table)
+                date_column = self._date_column(column_types)
+                columns = [col for col, _ in column_types]
+                if not date_column or not rollup_columns(columns):
+                    if table_name:
+                        print(f"Table '{table}' needs a DATE column and price columns to join '{FACT_TABLE}'.")
+                    continue
+                where = f" WHERE `{date_column}` > '{since}'" if since else ""
+                cursor.execute(f"SELECT COUNT(*) - COUNT(DISTINCT `{date_column}`) FROM `{table}`{where}")
+                if cursor.fetchone()[0]:
+                    print(f"Skipping '{table}': '{FACT_TABLE}' needs one row per date.")
+                    continue
+                for statement in fact_sync_statements(table, date_column, columns, since):
+                    cursor.execute(statement)
+                synced.append(table)
+            self.conn.commit()
+        except self.backend.error_types() as e:
+            self.conn.rollback()
+            print(f"The error '{e}' occurred")
+            return False
+        finally:
+            self.catalog.invalidate(FACT_TABLE)
+            self.result_cache.invalidate_table(self.db_index, FACT_TABLE)
+        print(f"Table '{FACT_TABLE}' updated from: {', '.join(synced) or 'no tables'}")
+        return bool(synced)
+
+    def analyze_table(self, table_name, batch_size=10000):
+        """
+        Builds a table's column statistics (min, max, nulls, approximate distinct count and
+        a value sample for quantiles) in one streaming pass and stores them. Uploads keep
+        them current, so this is only needed for tables loaded some other way.
+        """
+        import pandas as pd
+        if not self.conn:
+            print("No active database connection.")
+            return None
+        column_types = self.catalog.column_types(table_name)
+        if not column_types:
+            print(f"Table '{table_name}' does not exist.")
+            return None
+        columns = [col for col, _ in column_types]
+        table_stats = TableStats(table_name, {col: ColumnStats(col, column_kind(sql_type)) for col, sql_type in column_types})
+        cursor = self.backend.streaming_cursor(self.conn)
+        try:
+            cursor.execute(f"SELECT * FROM `{table_name}`")
+            for batch in self._fetch_batches(cursor, batch_size, None):
+                table_stats.update(pd.DataFrame(batch, columns=columns))
+        except self.backend.error_types() as e:
+            print(f"The error '{e}' occurred")
+            return None
+        finally:
+            cursor.close()
+        self._save_column_stats(table_stats)
+        print(f"Stored statistics of {len(columns)} columns over {table_stats.rows} rows of '{table_name}'.")
+        return table_stats
+
+    def column_stats(self, table_name):
+        """Returns the stored column statistics of a table, or None when it has none."""
+        if table_name not in self._table_stats:
+            table_stats = None
+            if self.catalog.has_table(STATS_TABLE):
+                table_stats = load_table_stats(self.conn.cursor(), self.backend, table_name)
+            self._table_stats[table_name] = table_stats
+        return self._table_stats[table_name]
+
+    def _save_column_stats(self, table_stats):
+        """Stores a table's column statistics, creating the hidden statistics table on first use."""
+        created = not self.catalog.has_table(STATS_TABLE)
+        save_table_stats(self.conn.cursor(), self.backend, table_stats)
+        self.conn.commit()
+        if created:
+            self.catalog.invalidate(STATS_TABLE)
+        self._table_stats[table_stats.table_name] = table_stats
+
+    def estimate_result_rows(self, sql_query, params=()):
+        """Estimates the rows a generated query returns from column statistics, without running it; None when unknown."""
+        match = FROM_REGEX.search(sql_query)
+        table_stats = self.column_stats(match.group(1)) if match and self.catalog.has_table(match.group(1)) else None
+        return table_stats.estimate_result_rows(sql_query, params) if table_stats else None
+
+    def _ticker_dimension(self, term, column_names):
+        """True when a term asks for the ticker of a single-ticker table and the `prices` table can answer it."""
+        return (term in TICKER_WORDS and TICKER_COLUMN not in [col.lower() for col in column_names]
+                and self.catalog is not None and self.catalog.has_table(FACT_TABLE))
+
+    def _rollups_of(self, table_name):
+        """Returns the names of the rollup tables that exist for a table."""
+        return {rollup_table_name(table_name, g) for g in GRANULARITIES
+                if self.catalog.has_table(rollup_table_name(table_name, g))}
+
+    def _date_column(self, column_types):
+        """Returns the DATE column named `Date` from (column, type) pairs, or None."""
+        return next((col for col, sql_type in column_types if col.lower() == "date" and sql_type == "date"), None)
+
+    def _route_to_rollup(self, sql_query):
+        """Rewrites an eligible aggregate query to read the smallest rollup that answers it exactly."""
+        match = AGGREGATE_QUERY_REGEX.match(sql_query)
+        if not match:
+            return sql_query
+        table_name = match.group("table")
+        available = self._rollups_of(table_name)
+        if not available:
+            return sql_query
+        column_types = self.catalog.column_types(table_name)
+        routed, rollup = route_to_rollup(sql_query, self.backend, self._date_column(column_types),
+                                         rollup_columns([col for col, _ in column_types]), available)
+        if routed is None:
+            return sql_query
+        print(f"(answered from rollup '{rollup}')")
+        return routed
+
+    def _infer_column_types(self, sample):
+        """Maps each column of a sample DataFrame to DATE, BIGINT, DOUBLE or TEXT."""
+        import pandas as pd
+        column_types = {}
+        for col in sample.columns:
+            values = sample[col].dropna()
+            if values.empty:
+                column_types[col] = "TEXT"
+                continue
+            if not pd.api.types.is_numeric_dtype(values):
+                text = values.astype(str).str.strip()
+                if text.str.fullmatch(DATE_REGEX).all():
+                    column_types[col] = "DATE"
+                    continue
+                values = pd.to_numeric(text, errors="coerce")
+                if values.isna().any():
+                    column_types[col] = "TEXT"
+                    continue
+                values = values.dropna()
+            if pd.api.types.is_integer_dtype(values) or pd.api.types.is_bool_dtype(values):
+                column_types[col] = "BIGINT"
+            elif pd.api.types.is_float_dtype(values):
+                column_types[col] = "DOUBLE"
+            else:
+                column_types[col] = "TEXT"
+        return column_types
+
+    def _date_key_column(self, sample, column_types):
+        """Returns the `Date` column if it can serve as the table's primary key, otherwise None."""
+        for col, sql_type in column_types.items():
+            if col.lower() == "date" and sql_type == "DATE":
+                return col if sample[col].notna().all() and sample[col].is_unique else None
+        return None
+
+    def _create_typed_table(self, cursor, table_name, column_types):
+        """Creates a table with inferred column types; its key and indexes are added by `_index_typed_table` after the load."""
+        column_defs = [f"`{col}` {sql_type}" for col, sql_type in column_types.items()]
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS `{table_name}` ({', '.join(column_defs)})")
+
+    def _index_typed_table(self, cursor, table_name, column_types, index_columns=None):
+        """
+        Keys a freshly loaded table on `Date` when every row has a distinct one, and otherwise
+        makes it a secondary index so range scans still use it; then adds the `index_columns`
+        indexes. The key is decided from all the rows rather than a sample, so a file with
+        repeated dates (several tickers per day) loads instead of failing partway.
+        """
+        index_columns = list(index_columns or [])
+        date_column = next((col for col, sql_type in column_types.items()
+                            if col.lower() == "date" and sql_type == "DATE"), None)
+        if date_column:
+            cursor.execute(f"SELECT COUNT(*) = COUNT(DISTINCT `{date_column}`) FROM `{table_name}`")
+            if cursor.fetchone()[0]:
+                column_defs = [f"`{col}` {sql_type}" for col, sql_type in column_types.items()]
+                for statement in self.backend.primary_key_statements(table_name, column_defs, date_column):
+                    cursor.execute(statement)
+            else:
+                print(f"'{date_column}' repeats or is missing in '{table_name}'; it is indexed instead of keyed.")
+                index_columns = [date_column] + index_columns
+        for col in dict.fromkeys(index_columns):
+            if col in column_types and column_types[col] != "TEXT":
+                index_name = f"idx_{table_name}_{col}".replace(" ", "_").lower()
+                cursor.execute(f"CREATE INDEX `{index_name}` ON `{table_name}` (`{col}`)")
+
+    def migrate_table_types(self, table_name, sample_rows=1000, index_columns=None):
+        """Converts the TEXT columns of an existing table in place to inferred DATE/BIGINT/DOUBLE types."""
+        if not self.conn:
+            print("No active database connection.")
+            return
+        if self.backend.name != "mysql":
+            print("In-place migration is only supported on MySQL; embedded tables are created with typed columns.")
+            return
+        import pandas as pd
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(f"DESCRIBE `{table_name}`")
+            described = cursor.fetchall()
+            text_columns = [col[0] for col in described if col[1].lower() == "text"]
+            if not text_columns:
+                print(f"Table '{table_name}' has no TEXT columns to migrate.")
+                return
+
+            # Infer types from a sample of the stored text values
+            column_list = ", ".join([f"`{col}`" for col in text_columns])
+            cursor.execute(f"SELECT {column_list} FROM `{table_name}` LIMIT {int(sample_rows)}")
+            sample = pd.DataFrame(cursor.fetchall(), columns=text_columns)
+            sample = sample.replace({"nan": None, "": None})
+            column_types = {col: t for col, t in self._infer_column_types(sample).items() if t != "TEXT"}
+            if not column_types:
+                print(f"No TEXT columns in '{table_name}' could be given a narrower type.")
+                return
+
+            # Legacy uploads stored missing values as 'nan' text, which typed columns reject
+            for col in column_types:
+                cursor.execute(f"UPDATE `{table_name}` SET `{col}` = NULL WHERE `{col}` IN ('nan', '')")
+            alterations = [f"MODIFY `{col}` {sql_type}" for col, sql_type in column_types.items()]
+            key_column = self._date_key_column(sample, column_types)
+            has_key = any(col[3] == "PRI" for col in described)
+            if key_column and not has_key:
+                alterations.append(f"ADD PRIMARY KEY (`{key_column}`)")
+            cursor.execute(f"ALTER TABLE `{table_name}` {', '.join(alterations)}")
+            for col in dict.fromkeys(index_columns or []):
+                if col in column_types:
+                    index_name = f"idx_{table_name}_{col}".replace(" ", "_").lower()
+                    cursor.execute(f"CREATE INDEX `{index_name}` ON `{table_name}` (`{col}`)")
+            self.conn.commit()
+            self._table_changed(table_name)
+            print(f"Migrated table '{table_name}': " + ", ".join([f"{col} -> {t}" for col, t in column_types.items()]))
+        except Exception as e:
+            self.conn.rollback()
+            print(f"An error occurred: {e}")
+
+    def _insert_statement(self, table_name, columns):
+        """Builds a parameterized INSERT statement for the given columns."""
+        column_list = ", ".join([f"`{col}`" for col in columns])
+        placeholders = ", ".join([self.backend.placeholder] * len(columns))
+        return f"INSERT INTO `{table_name}` ({column_list}) VALUES ({placeholders})"
+
+    def _parse_integers(self, cursor, table_name, chunk, integer_columns, widened):
+        """
+        Parses the integer columns of a chunk, read as text (see `csv_dtypes`), into exact
+        integers. A column holding a value that is not an integer is read as float64 from
+        then on and widened to DOUBLE, so a type inferred from the sample never fails an
+        upload after earlier chunks were committed.
+        """
+        import pandas as pd
+        for col in integer_columns:
+            values = None if col in widened else parse_integers(chunk[col])
+            if values is not None:
+                chunk[col] = values
+                continue
+            chunk[col] = pd.to_numeric(chunk[col])
+            if col in widened:
+                continue
+            widened.add(col)
+            statement = self.backend.widen_column_statement(table_name, col, "DOUBLE")
+            if statement:
+                cursor.execute(statement)
+                self.catalog.invalidate(table_name)
+                print(f"Column '{col}' of '{table_name}' holds fractional values; widened to DOUBLE.")
+
+    def _chunk_rows(self, chunk):
+        """Converts a DataFrame chunk into a list of row tuples with NaN mapped to NULL."""
+        return frame_rows(chunk)
+
+    def _insert_rows(self, cursor, insert_sql, rows, batch_size):
+        """Inserts rows in batches; on MySQL executemany sends each batch as one multi-row INSERT."""
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(insert_sql, rows[start:start + batch_size])
 
     def close_connection(self):
         """Closes the database connection."""
@@ -109,15 +636,14 @@ class ChatDB:
         cursor = self.conn.cursor()
         
         # List the tables
-        cursor.execute("SHOW TABLES")
-        tables = cursor.fetchall()
+        tables = self.catalog.tables()
         print("\nTables in the database:")
         for idx, table in enumerate(tables, start=1):
-            print(f"{idx} - {table[0]}")
+            print(f"{idx} - {table}")
         
         # Choose one of the tables
         try:
-            table_choice = tables[int(input("\nYour choice of the table to explore: ")) - 1][0]
+            table_choice = tables[int(input("\nYour choice of the table to explore: ")) - 1]
         except (IndexError, ValueError):
             print("Invalid choice. Please choose a valid table number.")
             return
@@ -125,20 +651,19 @@ class ChatDB:
         # List columns for the chosen table
         table_name = table_choice
         print(f"\nColumns in table '{table_name}':")
-        cursor.execute(f"DESCRIBE {table_name}")
-        columns = cursor.fetchall()
+        columns = self.catalog.column_types(table_name)
         for column in columns:
             print(f" - {column[0]} ({column[1]})")
         
         # Fetch sample data
         print(f"\nSample data from '{table_name}':")
-        cursor.execute(f"SELECT * FROM {table_name} LIMIT 5")
+        cursor.execute(f"SELECT * FROM `{table_name}` LIMIT 5")
         rows = cursor.fetchall()
         
         # Use pandas to display the data
         if rows:
             column_names = [col[0] for col in columns]
-            df = pd.DataFrame(rows, columns=column_names)
+            df = frame_from_batches([rows], column_names, dict(columns))
             print("\nSample Data:")
             print(df.to_markdown(index=False))
         else:
@@ -146,8 +671,13 @@ class ChatDB:
 
 
     def generate_query_examples(self, table_name, columns, construct=None):
-        """Generates example SQL queries using templates with optional specific constructs."""
+        """
+        Generates example SQL queries using templates with optional specific constructs.
+        With column statistics, filters use values found in the table and GROUP BY prefers
+        a column with few distinct values.
+        """
 
+        table_stats = self.column_stats(table_name)
         queries = []
         # query_template = "SELECT <col> <function> FROM <table_name>"
         query_descriptions = []
@@ -192,7 +722,7 @@ class ChatDB:
                 # Pattern: total (or other aggregate function) <A> by <B>
                 func = random.choice(agg_func)
                 agg_column = random.choice(columns)
-                grouped_column = random.choice(columns)
+                grouped_column = self._example_group_column(table_stats, columns)
                 queries.append(f"SELECT {columns[0]}, {func}({agg_column}) FROM {table_name} GROUP BY {grouped_column}")
                 for i, value in agg_keywords.items():
                     if func == i:
@@ -206,17 +736,17 @@ class ChatDB:
         
         # WHERE example with conditions using a pattern
         if construct == '' or construct.lower() == 'where':
-            sample_value = 'some_value'
             where_column = random.choice(columns)
             operator = random.choice(list(comparison_operators.keys()))
-            queries.append(f"SELECT * FROM {table_name} WHERE {where_column} {operator} '{sample_value}'")
-            query_descriptions.append(f"Select all rows from {table_name} where {where_column} is {comparison_operators[operator]} '{sample_value}'")
+            sample_value = self._example_value(table_stats, where_column, operator)
+            queries.append(f"SELECT * FROM {table_name} WHERE {where_column} {operator} {sample_value}")
+            query_descriptions.append(f"Select all rows from {table_name} where {where_column} is {comparison_operators[operator]} {sample_value}")
         
         # Complex query example using a pattern
         if len(columns) >= 3 and (construct == '' or construct.lower() in ['group by', 'aggregation', 'where', 'order by']):
-            sample_value = 'some_value'
-            queries.append(f"SELECT {columns[0]}, {columns[1]}, {agg_func[0]}({columns[2]}) FROM {table_name} WHERE {columns[1]} = '{sample_value}' GROUP BY {columns[0]} ORDER BY {columns[2]} DESC")
-            query_descriptions.append(f"Find {columns[0]}, {columns[1]}, and the total {columns[2]} using {agg_func[0]} from {table_name}, where {columns[1]} equals '{sample_value}', grouped by {columns[0]}, and ordered by {columns[2]} in descending order")
+            sample_value = self._example_value(table_stats, columns[1], '=')
+            queries.append(f"SELECT {columns[0]}, {columns[1]}, {agg_func[0]}({columns[2]}) FROM {table_name} WHERE {columns[1]} = {sample_value} GROUP BY {columns[0]} ORDER BY {columns[2]} DESC")
+            query_descriptions.append(f"Find {columns[0]}, {columns[1]}, and the total {columns[2]} using {agg_func[0]} from {table_name}, where {columns[1]} equals {sample_value}, grouped by {columns[0]}, and ordered by {columns[2]} in descending order")
         
         # Shuffle the queries and descriptions together to keep them in sync
         combined = list(zip(query_descriptions, queries))
@@ -225,6 +755,25 @@ class ChatDB:
 
         return list(zip(query_descriptions, queries))
 
+    def _example_value(self, table_stats, column, operator):
+        """A literal for `column <operator> value`: a stored value for (in)equality, a quartile for ranges."""
+        stats = table_stats.column(column) if table_stats else None
+        if stats is None or not stats.sample:
+            return "'some_value'"
+        value = random.choice(stats.sample) if operator in ("=", "!=") else stats.quantile(0.75 if ">" in operator else 0.25)
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return sql_literal(value)
+
+    def _example_group_column(self, table_stats, columns):
+        """A column worth grouping by: one with at most a tenth as many distinct values as rows, else any column."""
+        if table_stats:
+            groupable = [col for col in columns if table_stats.column(col)
+                         and 1 < table_stats.column(col).distinct <= max(1, table_stats.rows // 10)]
+            if groupable:
+                return random.choice(groupable)
+        return random.choice(columns)
+
     def suggest_queries(self):
         """Suggests example queries for each table with optional constructs."""
         if not self.conn:
@@ -232,9 +781,7 @@ class ChatDB:
             return            
 
         # List the tables
-        cursor = self.conn.cursor()
-        cursor.execute("SHOW TABLES")
-        tables = cursor.fetchall()
+        tables = self.catalog.tables()
 
         # Check if tables exist
         if not tables:
@@ -243,7 +790,7 @@ class ChatDB:
         
         print("\nTables in the database:")
         for idx, table in enumerate(tables, start=1):
-            print(f"{idx} - {table[0]}")
+            print(f"{idx} - {table}")
 
         # Input validation loop
         while True:
@@ -251,7 +798,7 @@ class ChatDB:
                 choice = int(input(f"\nYour choice of the table to explore (1 to {len(tables)}): "))
                 
                 if 1 <= choice <= len(tables):  # Validate range
-                    table_name = tables[choice - 1][0]  # Extract table name
+                    table_name = tables[choice - 1]  # Extract table name
                     break
                 else:
                     print(f"Invalid choice. Please enter a number between 1 and {len(tables)}.")
@@ -266,88 +813,109 @@ class ChatDB:
 
         # Proceed with the chosen table
         print(f"Selected table: {table_name}")
-        cursor.execute(f"DESCRIBE {table_name}")
-        columns = [col[0] for col in cursor.fetchall()]
+        columns = self.catalog.columns(table_name)
         if columns:
             print(f"\nExample queries for table '{table_name}':")
             queries = self.generate_query_examples(table_name, columns, construct)
             if queries:
                 for description, query in queries:
+                    estimate = self.estimate_result_rows(query)
+                    if estimate is not None:
+                        description += f" (about {estimate} rows)"
                     print(f" - {description}: \n{query}\n")
             else:
                 print("No queries available for the selected construct.")
 
+    def _compile_translation_engine(self):
+        """Compiles the query templates, phrase replacements and aggregation keywords once per instance."""
+        def alternation(words):
+            # Longest first so that e.g. "maximum" wins over "max" at the same position
+            return "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+        self._phrase_regex = re.compile(rf"\b(?:{alternation(self.PHRASE_REPLACEMENTS)})\b")
+        self._whitespace_regex = re.compile(r"\s+")
+
+        # One regex per template, plus a combined matcher of optional lookaheads that tests every
+        # template in a single match call; the first named group that participated wins
+        self._pattern_regexes = {}
+        self._pattern_groups = {}
+        lookaheads = []
+        for idx, pattern in enumerate(self.query_patterns):
+            regex = re.sub(r"<\w+>", r"([a-zA-Z0-9_ ]+)", pattern)
+            self._pattern_regexes[pattern] = re.compile(regex)
+            self._pattern_groups[f"p{idx}"] = pattern
+            lookaheads.append(f"(?=.*?(?P<p{idx}>{regex.replace('(', '(?:')}))?")
+        self._pattern_matcher = re.compile("".join(lookaheads))
+
+        self._agg_rank = {keyword: rank for rank, keyword in enumerate(self.AGGREGATION_FUNCTIONS)}
+        self._agg_keyword_regex = re.compile(alternation(self.AGGREGATION_FUNCTIONS))
+        self._agg_by_regex = re.compile(r" ([\w\s]+) by ([\w\s]+)")
+        self._agg_regex = re.compile(r" ([\w\s]+)")
+        self._find_where_regex = re.compile(r"find ([\w\s]+) where ([\w\s]+) is ([\w\s]+)")
+        self._window_size_regex = re.compile(r"\b(\d+)(?:-| )?(?:trading )?days?\b")
+        self._series_filler_regex = re.compile(rf"\b(?:{alternation(self.SERIES_FILLER_WORDS)})\b|\d+")
+
     def natural_language_to_sql(self, question, table_name, column_names):
         """
-        Convert a natural language question into an SQL query for the given table.
+        Convert a natural language question into an SQL query for the given table, with
+        any values written in as literals.
+        """
+        sql_query, params = self.natural_language_to_template(question, table_name, column_names)
+        return inline_params(sql_query, params, self.backend.placeholder) if params else sql_query
+
+    def natural_language_to_template(self, question, table_name, column_names):
+        """
+        Convert a natural language question into a (SQL template, parameters) pair. Values
+        taken from the question are bound rather than inlined, so questions of the same
+        shape share one template and one compiled statement. Messages have no parameters.
         """
         # Preprocess and split the question
-        cleaned_question = self._preprocess_question(question)
+        with instrumentation.stage("preprocess"):
+            cleaned_question = self._preprocess_question(question)
         # main_part, order_by_part = self._split_order_by(cleaned_question)
 
         # print(f"[DEBUG] Main Part: {main_part}")  # Debugging line
         # print(f"[DEBUG] Order By Part: {order_by_part}")  # Debugging line
 
-        # Process the main query
-        for pattern, function in self.query_patterns.items():
-            if self._match_pattern(cleaned_question, pattern):  # Match main part with patterns
-                try:
+        # Process the main query: all templates are tested in one pass, in declaration order
+        with instrumentation.stage("pattern_match"):
+            pattern = self._dispatch_pattern(cleaned_question)
+        if pattern is not None:
+            function = self.query_patterns[pattern]
+            try:
+                if self.debug:
                     print(f"[DEBUG] Matched Pattern: {pattern}")  # Debugging line
-                    sql_query = function(cleaned_question, table_name, column_names)
+                sql_query = function(cleaned_question, table_name, column_names)
 
-                    return sql_query
-                except Exception as e:
-                    print(f"[ERROR] Failed to process query for pattern '{pattern}'. Error: {e}")
-                    return f"Error occurred while processing query with pattern '{pattern}': {str(e)}"
+                return sql_query if isinstance(sql_query, tuple) else (sql_query, [])
+            except Exception as e:
+                print(f"[ERROR] Failed to process query for pattern '{pattern}'. Error: {e}")
+                return f"Error occurred while processing query with pattern '{pattern}': {str(e)}", []
 
-        print(f"[DEBUG] No matching pattern found for question: '{question}'")  # Debugging line
-        return f"Query pattern not recognized for question: '{question}'"
+        if self.debug:
+            print(f"[DEBUG] No matching pattern found for question: '{question}'")  # Debugging line
+        return f"Query pattern not recognized for question: '{question}'", []
 
+    def _dispatch_pattern(self, question):
+        """Returns the first template in `query_patterns` that matches the question, or None."""
+        match = self._pattern_matcher.match(question)
+        for group, pattern in self._pattern_groups.items():
+            if match.group(group) is not None:
+                return pattern
+        return None
 
     def _find_closest_column_name(self, term, column_names):
-        from difflib import get_close_matches
-
-        # Preprocess term and column names for matching
-        term_normalized = term.lower().replace(' ', '_')
-        column_names_normalized = [col.lower() for col in column_names]
-
-        # Step 1: Exact match
-        if term_normalized in column_names_normalized:
-            match = column_names[column_names_normalized.index(term_normalized)]
-            # print(f"[DEBUG] Exact match for '{term}': {match}")
-            return match
-
-        # Step 2: Check if any column contains the term as a substring
-        substring_matches = [col for col in column_names if term_normalized in col.lower()]
-        if substring_matches:
-            # print(f"[DEBUG] Substring match for '{term}': {substring_matches[0]}")
-            return substring_matches[0]  # Return the first substring match
-
-        # Step 3: Fuzzy matching (fallback)
-        matches = get_close_matches(term_normalized, column_names_normalized, n=1, cutoff=0.5)
-        if matches:
-            match = column_names[column_names_normalized.index(matches[0])]
-            # print(f"[DEBUG] Fuzzy match for '{term}': {match}")
-            return match
-
-        # Step 4: No match, return normalized term
-        # print(f"[DEBUG] No close match found for '{term}', using raw term.")
-        return term_normalized
+        """Resolves a term to a column through a cached per-table ColumnResolver."""
+        key = tuple(column_names)
+        resolver = self._resolvers.get(key)
+        if resolver is None:
+            resolver = self._resolvers[key] = ColumnResolver(column_names)
+        with instrumentation.stage("column_resolution"):
+            return resolver.resolve(term)
 
     def _preprocess_question(self, question):
-        phrase_replacements = {
-            "by": ["broken down by"],
-            "total": ["total", "sum", "aggregate"],
-            "average": ["average", "mean", "avg"],
-            "count": ["count", "the number of", "how many"]
-        }
-        question = question.lower()
-        for replacement, phrases in phrase_replacements.items():
-            for phrase in phrases:
-                if f" {phrase} " in f" {question} ": 
-                    question = question.replace(phrase, replacement)
-        question = re.sub(r'\s+', ' ', question).strip()
-        return question
+        question = self._whitespace_regex.sub(' ', question.lower()).strip()
+        return self._phrase_regex.sub(lambda m: self.PHRASE_REPLACEMENTS[m.group(0)], question)
 
 
     def _match_pattern(self, question, pattern):
@@ -355,22 +923,10 @@ class ChatDB:
         Match the question against a pattern with placeholders 
         (e.g., <A>, <B>, <C>) replaced by regex groups.
         """
-        try:
-            # Debug: Print original pattern
-            # print(f"[DEBUG] Original Pattern: {pattern}")
-            # Replace placeholders (e.g., <A>, <B>, <C>) with regex groups
-            regex = re.sub(r"<\w+>", r"([a-zA-Z0-9_ ]+)", pattern)
-            
-            # Debug: Print the compiled regex
-            # print(f"[DEBUG] Compiled Regex: {regex}")
-            
-            # Check if the regex matches the question
-            match = re.search(regex, question)
-            # print(f"[DEBUG] Regex Match: {match is not None}")  # Debug match result
-            return match is not None
-        except re.error as e:
-            # print(f"[ERROR] Invalid regex pattern: {pattern}. Error: {e}")
+        regex = self._pattern_regexes.get(pattern)
+        if regex is None:
             return False
+        return regex.search(question) is not None
         
     # def _split_order_by(self, question):
     #     # Split the question into main and ORDER BY parts
@@ -383,60 +939,142 @@ class ChatDB:
         """
         Generate an SQL query for aggregation functions (SUM, AVG, COUNT) with GROUP BY.
         """
-        # Define supported aggregation functions and their keywords
-        aggregation_functions = {
-            "sum": "SUM",
-            "total": "SUM",
-            "avg": "AVG",
-            "average": "AVG",
-            "mean": "AVG",
-            "count": "COUNT",
-            "the number of": "COUNT",
-            "max": "MAX",
-            "maximum": "MAX",
-            "greatest": "MAX",
-            "largest": "MAX",
-            "top": "MAX",
-            "min": "MIN",
-            "minimum": "MIN",
-            "least": "MIN",
-            "bottom": "MIN"
-        }
-        
-        # Detect the aggregation function and match the query pattern
-        for keyword, func in aggregation_functions.items():
-            
-            # Regex to match "total <A> by <B>" or similar patterns
-            match1 = re.search(fr"{keyword} ([\w\s]+) by ([\w\s]+)", question)
-            match2 = re.search(fr"{keyword} ([\w\s]+)", question)
-            #match3 = re.search(fr"([\w\s]+)", question)
+        # Scan the question once for aggregation keywords followed by a term,
+        # keeping every position of the highest-priority keyword found
+        best_keyword, positions = None, []
+        for match in self._agg_keyword_regex.finditer(question):
+            keyword = match.group(0)
+            if self._agg_regex.match(question, match.end()) is None:
+                continue
+            if best_keyword is None or self._agg_rank[keyword] < self._agg_rank[best_keyword]:
+                best_keyword, positions = keyword, [match.end()]
+            elif keyword == best_keyword:
+                positions.append(match.end())
+        if best_keyword is None:
+            return "Invalid query format."
+        func = self.AGGREGATION_FUNCTIONS[best_keyword]
+
+        # Regex to match "total <A> by <B>" or similar patterns
+        for position in positions:
+            match1 = self._agg_by_regex.match(question, position)
             if match1:
+                if self._ticker_dimension(match1.group(2).strip(), column_names):
+                    # Grouping by ticker reads the unified table instead of this ticker's own
+                    column_a = self._find_closest_column_name(match1.group(1).strip(), self.catalog.columns(FACT_TABLE))
+                    return f"SELECT {TICKER_COLUMN}, {func}({column_a}) FROM {FACT_TABLE} GROUP BY {TICKER_COLUMN};"
                 # Extract column names from the matched groups
-                column_a = self._find_closest_column_name(match1.group(1).strip(), column_names)
+                source = self._returns_source(match1.group(1).strip(), table_name, column_names)
+                if source:
+                    source, column_a = source
+                else:
+                    source, column_a = table_name, self._find_closest_column_name(match1.group(1).strip(), column_names)
+                bucket = self._time_bucket(match1.group(2).strip(), column_names)
+                if bucket:
+                    expression, alias = bucket
+                    return f"SELECT {expression} AS {alias}, {func}({column_a}) FROM {source} GROUP BY {expression};"
                 column_b = self._find_closest_column_name(match1.group(2).strip(), column_names)
                 # Return the SQL query
-                return f"SELECT {column_b}, {func}({column_a}) FROM {table_name} GROUP BY {column_b};"
-            elif match2: # Aggregate only with no Group By Clause
-                # Extract column names from the matched groups
-                column_a = self._find_closest_column_name(match2.group(1).strip(), column_names)
-                # Return the SQL query
-                return f"SELECT {func}({column_a}) FROM {table_name};"
-            # elif match3: 
-            #     # Extract column names from the matched groups
-            #     column_a = self._find_closest_column_name(match3.group(1).strip(), column_names)
-            #     # Return the SQL query
-            #     return f"SELECT {column_a} FROM {table_name};"
-            
-        return "Invalid query format."
+                return f"SELECT {column_b}, {func}({column_a}) FROM {source} GROUP BY {column_b};"
+
+        # Aggregate only with no Group By Clause
+        match2 = self._agg_regex.match(question, positions[0])
+        column_a = self._find_closest_column_name(match2.group(1).strip(), column_names)
+        return f"SELECT {func}({column_a}) FROM {table_name};"
+
+
+    def _returns_source(self, term, table_name, column_names):
+        """
+        For an aggregated term about returns ("average return of high by month"), returns a
+        derived table adding the daily return of the column, and its alias; otherwise None.
+        """
+        if not re.search(r"\breturns?\b", term) or any(col.lower() in ("return", "returns") for col in column_names):
+            return None
+        table_name, column_names, column, date_column = self._series_target(term, table_name, column_names)
+        if date_column is None:
+            return None
+        return (f"(SELECT {table_name}.*, {column} * 1e0 / LAG({column}) OVER (ORDER BY {date_column}) - 1 AS daily_return "
+                f"FROM {table_name}) AS returns"), "daily_return"
+
+    def _series_target(self, question, table_name, column_names):
+        """
+        Picks the table and column a window question is about: a phrase naming another table
+        (e.g. "daily return of nvda") switches to it, the first other phrase names the column,
+        and Close is the default. Returns (table, column names, column, date column).
+        """
+        words = re.sub(r"[^\w\s]", " ", question)
+        phrases = [" ".join(phrase.split()) for phrase in self._series_filler_regex.split(words) if phrase.strip()]
+        column_term = None
+        for phrase in phrases:
+            candidate = phrase.replace(" ", "_")
+            if candidate != table_name and self.catalog is not None and self.catalog.has_table(candidate):
+                table_name, column_names = candidate, self.catalog.columns(candidate)
+            elif column_term is None:
+                column_term = phrase
+        column = self._quote_identifier(self._find_closest_column_name(column_term or "close", column_names))
+        date_column = next((self._quote_identifier(col) for col in column_names if col.lower() == "date"), None)
+        return table_name, column_names, column, date_column
+
+    def _quote_identifier(self, name):
+        """Backquotes names that are not plain words, e.g. `Adj Close`; others are left bare."""
+        return name if re.fullmatch(r"\w+", name) else f"`{name}`"
+
+    def _window_size(self, question, default):
+        """Returns N of an "N day" or "N-day" phrase in the question, or `default`; other numbers, like years, are ignored."""
+        match = self._window_size_regex.search(question)
+        return max(1, int(match.group(1))) if match else default
 
+    def _moving_average_query(self, question, table_name, column_names):
+        """Generates a trailing moving average over the last N rows (trading days) with AVG() OVER."""
+        window = self._window_size(question, 20)
+        table_name, column_names, column, date_column = self._series_target(question, table_name, column_names)
+        if date_column is None:
+            return "Moving averages need a Date column."
+        return (f"SELECT {date_column}, {column}, AVG({column}) OVER (ORDER BY {date_column} "
+                f"ROWS BETWEEN {window - 1} PRECEDING AND CURRENT ROW) AS moving_average_{window} "
+                f"FROM {table_name} ORDER BY {date_column};")
+
+    def _return_query(self, question, table_name, column_names):
+        """Generates the return over the previous row ("daily return") or N rows with LAG()."""
+        periods = self._window_size(question, 1)
+        table_name, column_names, column, date_column = self._series_target(question, table_name, column_names)
+        if date_column is None:
+            return "Returns need a Date column."
+        lag = f"LAG({column})" if periods == 1 else f"LAG({column}, {periods})"
+        alias = "daily_return" if periods == 1 else f"return_{periods}"
+        # `* 1e0` makes the ratio floating point; SQLite divides BIGINT columns such as Volume as integers
+        return (f"SELECT {date_column}, {column}, {column} * 1e0 / {lag} OVER (ORDER BY {date_column}) - 1 AS {alias} "
+                f"FROM {table_name} ORDER BY {date_column};")
+
+    def _drawdown_query(self, question, table_name, column_names):
+        """Generates the drawdown from the running peak (MAX() OVER), or only its worst value for "max drawdown"."""
+        table_name, column_names, column, date_column = self._series_target(question, table_name, column_names)
+        if date_column is None:
+            return "Drawdowns need a Date column."
+        peak = f"MAX({column}) OVER (ORDER BY {date_column} ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)"
+        if re.search(r"\b(?:max|maximum|largest|worst|biggest)\b", question):
+            return (f"SELECT MIN({column} * 1e0 / peak - 1) AS max_drawdown "
+                    f"FROM (SELECT {column}, {peak} AS peak FROM {table_name}) AS running;")
+        return f"SELECT {date_column}, {column}, {column} * 1e0 / {peak} - 1 AS drawdown FROM {table_name} ORDER BY {date_column};"
+
+    def _time_bucket(self, term, column_names):
+        """Maps "week", "month" or "year" to (period expression over the Date column, alias), or None."""
+        granularity = BUCKET_WORDS.get(term)
+        date_column = next((col for col in column_names if col.lower() == "date"), None)
+        if granularity is None or date_column is None or self.backend is None:
+            return None
+        alias = {"weekly": "week", "monthly": "month", "yearly": "year"}[granularity]
+        return self.backend.period_expression(granularity, f"`{date_column}`"), alias
 
     def _find_where_query(self, question, table_name, column_names):
-        match = re.search(r"find ([\w\s]+) where ([\w\s]+) is ([\w\s]+)", question)
+        match = self._find_where_regex.search(question)
         if match:
+            if self._ticker_dimension(match.group(2).strip(), column_names):
+                a = self._find_closest_column_name(match.group(1).strip(), self.catalog.columns(FACT_TABLE))
+                return f"SELECT {a} FROM {FACT_TABLE} WHERE {TICKER_COLUMN} = {self.backend.placeholder};", [match.group(3).strip().lower()]
             a = self._find_closest_column_name(match.group(1).strip(), column_names)
             b = self._find_closest_column_name(match.group(2).strip(), column_names)
-            c = match.group(3).strip()  # No need to validate values
-            return f"SELECT {a} FROM {table_name} WHERE {b} = '{c}';"
+            c = match.group(3).strip()  # No need to validate values; they are bound, never inlined
+            return f"SELECT {a} FROM {table_name} WHERE {b} = {self.backend.placeholder};", [c]
         return "Invalid query format."
 
     def _append_order_by(self, sql_query, order_by_part, column_names):
@@ -458,31 +1096,252 @@ class ChatDB:
         # print(f"[DEBUG] Invalid ORDER BY part: {order_by_part}")  # Debugging line
         return sql_query
 
-    def execute_query(self):
-        """Executes a SQL query and returns the results."""
+    def execute_query(self, query=None, stream=True, batch_size=1000, page_size=50, max_rows=None, export_path=None):
+        """
+        Executes a SQL query and displays or exports the results.
+
+        With `stream`, rows are read through an unbuffered server-side cursor in batches of
+        `batch_size`, rendered `page_size` rows at a time or written to a `.csv`/`.jsonl`
+        `export_path`, and capped at `max_rows`, so memory is bounded by the batch size.
+        The query and export path are prompted for when `query` is not given.
+        """
         if not self.conn:
             print("No active database connection.")
             return
+        interactive = query is None
+        if interactive:
+            # List the tables
+            tables = self.catalog.tables()
+            print("\nTables in the database:")
+            for idx, table in enumerate(tables, start=1):
+                print(f"{idx} - {table}")
+            
+            query = input("Enter your SQL query: ")
+            export_path = input("Enter an export file path (.csv or .jsonl), or press Enter to display the results: ").strip() or None
+
+        try:
+            if stream or export_path:
+                self._stream_query(query, batch_size, page_size, max_rows, export_path, interactive)
+                return
+            # Batches go straight into compacted columns; the rows are never held as a list of tuples
+            columns, batches = self._query_batches(query, max_rows, batch_size=batch_size, streaming=True)
+            if columns is None:
+                return
+            try:
+                df = frame_from_batches(batches, columns, compact=True)
+            finally:
+                batches.close()
+            with instrumentation.stage("render"):
+                print("\nQuery Results:")
+                if self.last_plan:
+                    print(format_plan(self.last_plan))
+                print(df.to_markdown(index=False))
+                print(f"{len(df)} rows returned ({format_bytes(frame_memory(df))} in memory, "
+                      f"{format_bytes(df.attrs['uncompacted_bytes'])} before downcasting).")
+        except QueryRefused as e:
+            print(e)
+        except self.backend.error_types() + (OSError, ValueError) as e:
+            print(f"The error '{e}' occurred")
+
+    def fetch_query(self, query, max_rows=None, params=None):
+        """
+        Runs a query and returns (columns, rows), reading rollups and the result cache when possible.
+
+        With `params`, the query is a template (see `natural_language_to_template`) executed
+        with its values bound by the driver.
+        Statements without a result set are committed and return (None, affected row count).
+        Driver errors, and QueryRefused for SELECTs over the guard's budget, are raised to the caller.
+        """
+        columns, batches = self._query_batches(query, max_rows, params)
+        if columns is None:
+            return None, batches
+        return columns, [row for batch in batches for row in batch]
+
+    def _query_batches(self, query, max_rows=None, params=None, batch_size=1000, streaming=False, cache=True):
+        """
+        Runs a query like `fetch_query` but returns (columns, batches): a generator of lists of
+        at most `batch_size` rows, fetched from the cursor as it is consumed. With `streaming`
+        the rows come from an unbuffered server-side cursor; closing the generator closes the
+        cursor. With `cache`, a result of at most `cache_max_rows` rows is cached once read in full,
+        keyed with `max_rows` as well, since the fetch stops there even when the query's own LIMIT
+        is larger.
+        """
+        self.last_plan = None
+        sql_query = self._apply_row_cap(self._route_to_rollup(query), self.guard.row_cap(max_rows))
+        # Cache entries and plans are keyed by the query with its values inlined
+        literal_query = sql_query if params is None else inline_params(sql_query, params, self.backend.placeholder)
+        cache_key = literal_query if max_rows is None else f"{literal_query} /* first {int(max_rows)} rows */"
+        cached = self._cached_result(cache_key)
+        if cached is not None:
+            columns, rows = cached
+            return columns, (rows[start:start + batch_size] for start in range(0, len(rows), batch_size))
+        self._review_plan(literal_query)
+        cursor = self.backend.streaming_cursor(self.conn) if streaming else self.conn.cursor()
+        try:
+            with instrumentation.stage("sql_execution"):
+                if params is None:
+                    cursor.execute(sql_query)
+                else:
+                    self.backend.execute_template(cursor, sql_query, params)
+            if cursor.description is None:
+                self._finish_write(literal_query, cursor)
+                rowcount = cursor.rowcount
+                cursor.close()
+                return None, rowcount
+        except Exception:
+            cursor.close()
+            raise
+        columns = [desc[0] for desc in cursor.description]
+        batches = self._fetch_batches(cursor, batch_size, max_rows)
+        if cache and is_cacheable(literal_query):
+            batches = self._caching_batches(cache_key, columns, batches)
+        return columns, batches
+
+    def _caching_batches(self, sql_query, columns, batches):
+        """Passes batches through, caching the result when it ends within `cache_max_rows` rows."""
+        rows = []
+        for batch in batches:
+            if rows is not None:
+                # Past the budget nothing more is kept, so a large result costs no extra memory
+                if len(rows) + len(batch) <= self.cache_max_rows:
+                    rows.extend(batch)
+                else:
+                    rows = None
+            yield batch
+        if rows is not None:
+            self.result_cache.put(self.db_index, sql_query, columns, rows)
+
+    def _review_plan(self, sql_query):
+        """Runs the cost guard on a query about to execute and keeps its plan summary in `last_plan`."""
+        with instrumentation.stage("plan"):
+            self.last_plan = self.guard.review(self.conn, self.backend, sql_query, self.catalog.tables())
+        return self.last_plan
+
+    def _apply_row_cap(self, query, max_rows):
+        """Pushes a row cap down as a LIMIT clause on SELECT queries that do not have one."""
+        query = query.strip().rstrip(";")
+        if max_rows is None or not re.match(r"(?is)\s*select\b", query) or re.search(r"(?i)\blimit\s+\d+", query):
+            return query
+        return f"{query} LIMIT {int(max_rows)}"
+
+    def _cached_result(self, sql_query):
+        """Returns the cached (columns, rows) of a SELECT, or None."""
+        if not is_cacheable(sql_query):
+            return None
+        cached = self.result_cache.get(self.db_index, sql_query)
+        if cached is not None:
+            print("(cached result)")
+        return cached
+
+    def _finish_write(self, sql_query, cursor):
+        """Commits a statement without a result set and drops cached state for the table it changed."""
+        self.conn.commit()
+        table_name = written_table(sql_query)
+        if table_name:
+            dropped = re.match(r"(?i)\s*drop\b", sql_query) is not None
+            self._table_changed(table_name, dropped=dropped)
+            if dropped and self.catalog.has_table(STATS_TABLE):
+                delete_table_stats(self.conn.cursor(), self.backend, table_name)
+                self.conn.commit()
+        print(f"Query OK, {cursor.rowcount} rows affected.")
+
+    def _table_changed(self, table_name, dropped=False):
+        """
+        Drops cached state of a table whose rows changed outside an upload, and of its rollups,
+        which are then rebuilt; they are dropped along with the table, or when they can no
+        longer be built, so a query is never answered from a stale rollup.
+        """
+        self.result_cache.invalidate_table(self.db_index, table_name)
+        self.catalog.invalidate(table_name)
+        self._table_stats.pop(table_name, None)
+        rollups = self._rollups_of(table_name)
+        for rollup in rollups:
+            self.result_cache.invalidate_table(self.db_index, rollup)
+        if not rollups or (not dropped and self.build_rollups(table_name)):
+            return
         cursor = self.conn.cursor()
+        for rollup in sorted(rollups):
+            cursor.execute(f"DROP TABLE IF EXISTS `{rollup}`")
+            self.catalog.invalidate(rollup)
+        self.conn.commit()
+        print(f"Rollups of '{table_name}' dropped: {', '.join(sorted(rollups))}")
 
-        # List the tables
-        cursor.execute("SHOW TABLES")
-        tables = cursor.fetchall()
-        print("\nTables in the database:")
-        for idx, table in enumerate(tables, start=1):
-            print(f"{idx} - {table[0]}")
-        
-        query = input("Enter your SQL query: ")
+    def _fetch_batches(self, cursor, batch_size, max_rows):
+        """
+        Yields lists of at most `batch_size` rows from a cursor, stopping after `max_rows` rows.
+        The cursor is closed when the rows run out or the generator is closed.
+        """
+        fetched = 0
+        try:
+            while max_rows is None or fetched < max_rows:
+                size = batch_size if max_rows is None else min(batch_size, max_rows - fetched)
+                with instrumentation.stage("fetch"):
+                    rows = cursor.fetchmany(size)
+                if not rows:
+                    return
+                fetched += len(rows)
+                yield rows
+        finally:
+            cursor.close()
 
+    def _stream_query(self, query, batch_size, page_size, max_rows, export_path, pause):
+        """Runs a query on a streaming cursor and renders or exports its rows batch by batch."""
+        # Displayed rows are cached within `cache_max_rows`; exports are never cached
+        columns, batches = self._query_batches(query, max_rows, batch_size=batch_size, streaming=True,
+                                               cache=not export_path)
+        if columns is None:
+            return
         try:
-            cursor.execute(query)
-            results = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            df = pd.DataFrame(results, columns=columns)
-            print("\nQuery Results:")
-            print(df.to_markdown(index=False))
-        except MySQLError as e:
-            print(f"The error '{e}' occurred")
+            if self.last_plan:
+                print(format_plan(self.last_plan))
+            if export_path:
+                total = self._export_batches(batches, columns, export_path)
+                print(f"Exported {total} rows to '{export_path}'.")
+            else:
+                self._render_pages(batches, columns, page_size, pause)
+        finally:
+            batches.close()
+
+    def _render_pages(self, batches, columns, page_size, pause):
+        """Prints rows as markdown tables of `page_size` rows, optionally pausing between pages."""
+        page, total = [], 0
 
+        def flush():
+            with instrumentation.stage("render"):
+                print(frame_from_batches([page], columns, compact=True).to_markdown(index=False))
+            page.clear()
 
+        print("\nQuery Results:")
+        for rows in batches:
+            for row in rows:
+                page.append(row)
+                total += 1
+                if len(page) == page_size:
+                    flush()
+                    if pause and input("-- Press Enter for more rows, or 'q' to stop: ").strip().lower() == "q":
+                        print(f"Stopped after {total} rows.")
+                        return
+        if page or total == 0:
+            flush()
+        print(f"{total} rows returned.")
+
+    def _export_batches(self, batches, columns, export_path):
+        """Writes row batches to a CSV or JSON-lines file and returns the number of rows written."""
+        import csv
+        as_json = export_path.lower().endswith((".jsonl", ".json"))
+        if not as_json and not export_path.lower().endswith(".csv"):
+            raise ValueError("Export path must end with .csv or .jsonl")
+        total = 0
+        with open(export_path, "w", newline="", encoding="utf-8") as file:
+            if as_json:
+                for rows in batches:
+                    file.writelines(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
+                    total += len(rows)
+            else:
+                writer = csv.writer(file)
+                writer.writerow(columns)
+                for rows in batches:
+                    writer.writerows(rows)
+                    total += len(rows)
+        return total
 
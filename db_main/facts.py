@@ -0,0 +1,35 @@
+from db_main.rollups import OHLCV_RULES
+
+# Unified price table holding every ticker's rows, keyed by (ticker, Date)
+FACT_TABLE = "prices"
+TICKER_COLUMN = "ticker"
+TICKER_LENGTH = 64  # Tickers are table names, so they are sized to MySQL's identifier limit
+FACT_COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+# Words that ask for the ticker as a dimension
+TICKER_WORDS = {"ticker", "tickers", "symbol", "symbols", "stock", "stocks", "company", "companies"}
+
+
+def fact_table_statement(backend):
+    """Returns the CREATE statement of the fact table, clustered or partitioned by ticker on the backend."""
+    column_defs = [f"`{TICKER_COLUMN}` VARCHAR({TICKER_LENGTH}) NOT NULL", "`Date` DATE NOT NULL"]
+    column_defs += [f"`{col}` {'BIGINT' if OHLCV_RULES[col.lower()] == 'sum' else 'DOUBLE'}" for col in FACT_COLUMNS]
+    column_defs.append(f"PRIMARY KEY (`{TICKER_COLUMN}`, `Date`)")
+    return backend.partitioned_table_statement(FACT_TABLE, column_defs, TICKER_COLUMN)
+
+
+def fact_sync_statements(table_name, date_column, column_names, since=None):
+    """
+    Returns the statements replacing one ticker's rows in the fact table with those of its
+    own table, only for dates after `since` when it is given. Fact columns the table lacks stay NULL.
+    """
+    by_lower = {col.lower(): col for col in column_names}
+    shared = [col for col in FACT_COLUMNS if col.lower() in by_lower]
+    where = f" AND `Date` > '{since}'" if since else ""
+    source_where = f" WHERE `{date_column}` > '{since}'" if since else ""
+    target = ", ".join([f"`{TICKER_COLUMN}`", "`Date`"] + [f"`{col}`" for col in shared])
+    selected = ", ".join([f"'{table_name}'", f"`{date_column}`"] + [f"`{by_lower[col.lower()]}`" for col in shared])
+    return [
+        f"DELETE FROM `{FACT_TABLE}` WHERE `{TICKER_COLUMN}` = '{table_name}'{where}",
+        f"INSERT INTO `{FACT_TABLE}` ({target}) SELECT {selected} FROM `{table_name}`{source_where}",
+    ]
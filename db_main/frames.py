@@ -0,0 +1,144 @@
+import numbers
+
+from db_main.stats import column_kind
+
+# pandas and NumPy are imported inside the functions that need them, like elsewhere
+
+
+def frame_memory(frame):
+    """Bytes held by a DataFrame, including the Python objects in its object columns."""
+    return int(frame.memory_usage(index=False, deep=True).sum())
+
+
+def format_bytes(size):
+    """Formats a byte count as B, KB or MB."""
+    for unit in ("B", "KB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} MB"
+
+
+def csv_dtypes(column_types, columns):
+    """
+    Declares read_csv dtypes from SQL column types so pandas skips inference: numbers as
+    float64 and dates and text as strings. Integer columns are read as strings too, since
+    their type may come from a sample and a later chunk can hold a fractional value;
+    `parse_integers` turns them into exact integers chunk by chunk.
+    """
+    dtypes = {}
+    for col in columns:
+        sql_type = (column_types.get(col) or "").lower()
+        numeric = column_kind(sql_type) == "number" and "int" not in sql_type
+        dtypes[col] = "float64" if numeric else "str"
+    return dtypes
+
+
+def parse_integers(series):
+    """
+    Parses a text column into nullable Int64 without a detour through float64, so values
+    beyond 2**53 such as nanosecond timestamps stay exact; returns None when a value is
+    not an integer.
+    """
+    try:
+        return series.astype("Int64")
+    except (TypeError, ValueError):
+        return None
+
+
+def compact_series(series, category_ratio=0.5, float_ulps=4):
+    """
+    Returns a column with a value-preserving downcast: integers to the smallest integer
+    type, whole-number floats to (nullable) integers, other floats to float32 when every
+    value comes back within `float_ulps` units in the last place of float64 (price feeds
+    are float32 data printed to 17 digits), and repetitive text to a categorical.
+    """
+    import numpy as np
+    import pandas as pd
+    if pd.api.types.is_bool_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast="integer")
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        present = values[~np.isnan(values)]
+        if len(present) and np.abs(present).max() < 2 ** 53 and np.array_equal(present, np.trunc(present)):
+            integers = series.astype("Int64") if len(present) < len(values) else series.astype(np.int64)
+            return pd.to_numeric(integers, downcast="integer")
+        single = values.astype(np.float32)
+        tolerance = float_ulps * np.spacing(np.abs(values))
+        if np.all((np.abs(single.astype(np.float64) - values) <= tolerance) | np.isnan(values)):
+            return pd.Series(single, index=series.index, name=series.name)
+        return series
+    if not isinstance(series.dtype, pd.CategoricalDtype) and len(series) \
+            and series.nunique(dropna=False) <= category_ratio * len(series):
+        return series.astype("category")
+    return series
+
+
+def _batch_array(values, kind):
+    """Turns one column of a batch into a NumPy array: float64 with NaN for missing numbers, objects otherwise."""
+    import numpy as np
+    if kind == "number":
+        if None in values:
+            return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        array = np.array(values)
+        # DECIMAL columns arrive as decimal.Decimal objects
+        return array.astype(np.float64) if array.dtype == object else array
+    return np.array(values, dtype=object)
+
+
+def frame_from_batches(batches, columns, column_types=None, compact=False):
+    """
+    Builds a DataFrame column by column from batches of cursor rows. Each batch is split
+    into per-column arrays as it arrives, so the rows of only one batch are alive at a time.
+    `column_types` are SQL types by column; without them a column's kind is taken from its
+    first value. With `compact`, each column goes through `compact_series` as soon as it is
+    assembled, so a full-width copy of the frame never exists; the bytes the columns held
+    before downcasting are kept in `frame.attrs["uncompacted_bytes"]`.
+    """
+    import numpy as np
+    import pandas as pd
+    kinds = [column_kind(column_types.get(col)) for col in columns] if column_types else None
+    parts = [[] for _ in columns]
+    for batch in batches:
+        if not batch:
+            continue
+        if kinds is None:
+            kinds = []
+            for position in range(len(columns)):
+                first = next((row[position] for row in batch if row[position] is not None), None)
+                numeric = isinstance(first, numbers.Number) and not isinstance(first, bool)
+                kinds.append("number" if numeric else "text")
+        for position, column_values in enumerate(zip(*batch)):
+            parts[position].append(_batch_array(list(column_values), kinds[position]))
+    data, uncompacted = {}, 0
+    for position in range(len(columns)):
+        arrays = parts[position]
+        series = pd.Series(np.concatenate(arrays) if arrays else np.array([], dtype=object))
+        parts[position] = None
+        if compact:
+            uncompacted += int(series.memory_usage(index=False, deep=True))
+            series = compact_series(series)
+        data[position] = series
+    frame = pd.DataFrame(data)
+    frame.columns = list(columns)
+    if compact:
+        frame.attrs["uncompacted_bytes"] = uncompacted
+    return frame
+
+
+def frame_rows(frame):
+    """
+    Converts a DataFrame into row tuples with missing values as None, ready for executemany,
+    one column at a time instead of through an object-dtype copy of the whole frame.
+    """
+    import numpy as np
+    columns = []
+    for position in range(frame.shape[1]):
+        series = frame.iloc[:, position]
+        values = series.tolist()
+        for missing in np.flatnonzero(series.isna().to_numpy()):
+            values[missing] = None
+        columns.append(values)
+    return list(zip(*columns))
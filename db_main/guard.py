@@ -0,0 +1,95 @@
+import re
+
+from db_main.cache import is_cacheable
+
+# Plan notes of a sort or grouping materialized outside any index
+TEMPORARY_REGEX = re.compile(r"temp b-tree|using temporary|using filesort", re.IGNORECASE)
+LIMIT_REGEX = re.compile(r"\blimit\s+(\d+)\s*$", re.IGNORECASE)
+
+
+class QueryRefused(ValueError):
+    """Raised for a query whose estimated cost is above the guard's budget."""
+
+
+def summarize_plan(steps, sql):
+    """
+    Reduces the steps of a backend's `explain` to a plan summary: the estimated rows read,
+    the fully scanned tables and the warnings worth showing next to the results.
+    """
+    tables = [step for step in steps if step["table"]]
+    temporary = [step["extra"] for step in steps if TEMPORARY_REGEX.search(step["extra"])]
+    rows = sum(step["rows"] for step in tables)
+    limit = LIMIT_REGEX.search(sql.strip().rstrip(";"))
+    filtered = re.search(r"\bwhere\b", sql, re.IGNORECASE) is not None
+    # An unfiltered single-table read without a sort stops at its LIMIT
+    if limit and len(tables) == 1 and not filtered and not temporary:
+        rows = min(rows, int(limit.group(1)))
+    warnings = []
+    for step in tables:
+        if step["missing_index"]:
+            warnings.append(f"no index on `{step['table']}` for this query")
+        elif step["full_scan"] and (filtered or len(tables) > 1):
+            warnings.append(f"full scan of `{step['table']}` although the query filters or joins it")
+        elif step["full_scan"]:
+            warnings.append(f"full scan of `{step['table']}`")
+    warnings += [f"sort outside an index ({note})" for note in temporary]
+    return {
+        "rows_scanned": rows,
+        "full_scans": [step["table"] for step in tables if step["full_scan"]],
+        "indexes": [step["index"] for step in tables if step["index"]],
+        "warnings": warnings,
+    }
+
+
+def format_plan(plan):
+    """One line describing a plan summary, e.g. `Plan: ~9909 rows read; full scan of `aapl``."""
+    line = f"Plan: ~{plan['rows_scanned']} rows read"
+    if plan["indexes"]:
+        line += f" using {', '.join(plan['indexes'])}"
+    if plan["warnings"]:
+        line += "; " + "; ".join(plan["warnings"])
+    return line
+
+
+class QueryGuard:
+    """
+    Cost check run on every SELECT before it executes. The plan is estimated with EXPLAIN;
+    queries estimated to read more than `max_rows_scanned` rows are refused, and SELECTs
+    without a LIMIT get `auto_limit` appended. Either setting may be None to turn it off.
+    """
+
+    def __init__(self, max_rows_scanned=None, auto_limit=None, enabled=True):
+        self.max_rows_scanned = max_rows_scanned
+        self.auto_limit = auto_limit
+        self.enabled = enabled
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a guard from the optional `guard` object of a `db_cred.json` entry."""
+        config = config or {}
+        return cls(config.get("max_rows_scanned"), config.get("auto_limit"), config.get("enabled", True))
+
+    def row_cap(self, max_rows=None):
+        """The LIMIT to push down: the smaller of the caller's row cap and the automatic one."""
+        caps = [cap for cap in (max_rows, self.auto_limit if self.enabled else None) if cap is not None]
+        return min(caps) if caps else None
+
+    def review(self, conn, backend, sql, table_names):
+        """
+        Returns the plan summary of a SELECT, or None for other statements and plans the
+        backend cannot produce (the query itself will then report the error).
+        Raises QueryRefused when the estimate is over budget.
+        """
+        if not self.enabled or not is_cacheable(sql):
+            return None
+        try:
+            steps = backend.explain(conn, sql, table_names)
+        except backend.error_types():
+            return None
+        plan = summarize_plan(steps, sql)
+        if self.max_rows_scanned is not None and plan["rows_scanned"] > self.max_rows_scanned:
+            raise QueryRefused(
+                f"Query refused: it would read ~{plan['rows_scanned']} rows, above the budget of "
+                f"{self.max_rows_scanned}. {format_plan(plan)}. Add a filter on an indexed column or a LIMIT."
+            )
+        return plan
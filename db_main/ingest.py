@@ -0,0 +1,180 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_main.db_setup import ChatDB, table_name_from_file
+
+
+def discover_csvs(data_dir):
+    """Returns sorted (path, table name) pairs for the CSVs in a directory, skipping files that map to a taken name."""
+    found = {}
+    for file_name in sorted(os.listdir(data_dir)):
+        if not file_name.lower().endswith(".csv"):
+            continue
+        table_name = table_name_from_file(file_name)
+        if table_name in found:
+            print(f"Skipping '{file_name}': table '{table_name}' already comes from '{os.path.basename(found[table_name])}'.")
+            continue
+        found[table_name] = os.path.join(data_dir, file_name)
+    return [(path, table_name) for table_name, path in found.items()]
+
+
+class IngestManifest:
+    """JSON record of the files an ingest has started and finished, so a rerun resumes after a crash."""
+
+    def __init__(self, path):
+        """Loads the manifest at `path`, starting empty when it does not exist yet."""
+        self.path = path
+        self._lock = threading.Lock()
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                self.files = json.load(file).get("files", {})
+
+    @staticmethod
+    def _fingerprint(file_path):
+        stat = os.stat(file_path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def is_done(self, file_path):
+        """True when the file was fully loaded and has not changed since."""
+        entry = self.files.get(os.path.abspath(file_path))
+        return bool(entry) and entry["status"] == "done" and entry["fingerprint"] == self._fingerprint(file_path)
+
+    def was_interrupted(self, file_path):
+        """True when a previous run started loading the file but never finished it."""
+        entry = self.files.get(os.path.abspath(file_path))
+        return bool(entry) and entry["status"] == "loading"
+
+    def mark(self, file_path, table_name, status, rows=None):
+        """Records a file's status and rewrites the manifest atomically."""
+        with self._lock:
+            self.files[os.path.abspath(file_path)] = {
+                "table": table_name,
+                "status": status,
+                "rows": rows,
+                "fingerprint": self._fingerprint(file_path),
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump({"files": self.files}, file, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+class DirectoryIngest:
+    """
+    Loads a directory of CSVs through a pool of database connections: each worker takes a
+    file and streams it in with `ChatDB.upload_dataset` on its own connection, so memory
+    is bounded by `connections` x `chunk_size` rows whatever the file sizes, and every file
+    gets the same types, statistics, rollups and fact-table sync as an interactive upload.
+    """
+
+    def __init__(self, cred_json, db_index, connections=4, chunk_size=10000, batch_size=1000,
+                 index_columns=None, overwrite=False):
+        """Keeps the run settings; connections are opened when `run` starts."""
+        self.cred_json = cred_json
+        self.db_index = db_index
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.index_columns = index_columns
+        self.overwrite = overwrite
+        self._pool = queue.Queue()
+        self._all = []
+        self._progress_lock = threading.Lock()
+        self._completed = 0
+
+    def _open_pool(self):
+        """Connects the pool; returns False when the database cannot be reached."""
+        first = ChatDB(self.cred_json, self.db_index)
+        self._all.append(first)
+        if not first.conn:
+            return False
+        # SQLite has a single writer (and every :memory: connection is its own database), so extra connections only contend
+        size = 1 if first.backend.name == "sqlite" else max(1, self.connections)
+        self._pool.put(first)
+        for _ in range(size - 1):
+            chatdb = ChatDB(self.cred_json, self.db_index)
+            self._all.append(chatdb)
+            if chatdb.conn:
+                self._pool.put(chatdb)
+        self.connections = self._pool.qsize()
+        return True
+
+    def _load(self, file_path, table_name, manifest, total):
+        """Uploads one file on a pooled connection, replacing a table left behind by an interrupted run."""
+        chatdb = self._pool.get()
+        try:
+            chatdb.catalog.invalidate(table_name)
+            if chatdb.catalog.has_table(table_name) and not (self.overwrite or manifest.was_interrupted(file_path)):
+                return self._report(file_path, table_name, "skipped", 0, 0, total, "table exists")
+            manifest.mark(file_path, table_name, "loading")
+            start = time.perf_counter()
+            rows = chatdb.upload_dataset(file_path, table_name, chunk_size=self.chunk_size, batch_size=self.batch_size,
+                                         index_columns=self.index_columns, if_exists="overwrite")
+            if rows is None:
+                return self._report(file_path, table_name, "failed", 0, 0, total, "nothing was uploaded; see the error above")
+            manifest.mark(file_path, table_name, "done", rows)
+            return self._report(file_path, table_name, "done", rows, time.perf_counter() - start, total)
+        except Exception as e:
+            return self._report(file_path, table_name, "failed", 0, 0, total, str(e))
+        finally:
+            self._pool.put(chatdb)
+
+    def _report(self, file_path, table_name, status, rows, seconds, total, detail=None):
+        """Prints one line of per-file progress and returns the file's result."""
+        with self._progress_lock:
+            self._completed += 1
+            line = f"[{self._completed}/{total}] {os.path.basename(file_path)} -> '{table_name}': {status}"
+            if status == "done":
+                line += f", {rows} rows in {seconds:.2f}s"
+            if detail:
+                line += f" ({detail})"
+            print(line)
+        return {"file": file_path, "table": table_name, "status": status, "rows": rows, "error": detail if status == "failed" else None}
+
+    def run(self, data_dir, manifest_path=None):
+        """Ingests every CSV in `data_dir` not already recorded as done in the manifest; returns a summary."""
+        summary = {"files": 0, "done": 0, "skipped": 0, "failed": 0, "rows": 0}
+        if not os.path.isdir(data_dir):
+            print(f"Data directory '{data_dir}' was not found.")
+            return summary
+        manifest = IngestManifest(manifest_path or os.path.join(data_dir, ".ingest_manifest.json"))
+        files = discover_csvs(data_dir)
+        todo = [(path, table) for path, table in files if not manifest.is_done(path)]
+        summary["files"] = len(files)
+        summary["skipped"] = len(files) - len(todo)
+        if summary["skipped"]:
+            print(f"Resuming: {summary['skipped']} of {len(files)} files are already loaded.")
+        if not todo:
+            return summary
+
+        start = time.perf_counter()
+        try:
+            if not self._open_pool():
+                summary["failed"] = len(todo)
+                return summary
+            with ThreadPoolExecutor(max_workers=self.connections) as loaders:
+                loads = [loaders.submit(self._load, path, table_name, manifest, len(todo)) for path, table_name in todo]
+                for load in loads:
+                    result = load.result()
+                    summary[result["status"]] += 1
+                    summary["rows"] += result["rows"]
+        finally:
+            for chatdb in self._all:
+                chatdb.close_connection()
+        elapsed = time.perf_counter() - start
+        summary["seconds"] = round(elapsed, 3)
+        summary["rows_per_sec"] = round(summary["rows"] / elapsed, 1) if elapsed else None
+        return summary
+
+
+def run_ingest(cred_json, db_index, data_dir, manifest_path=None, connections=4, overwrite=False):
+    """Runs a directory ingest end to end and prints its summary."""
+    ingest = DirectoryIngest(cred_json, db_index, connections=connections, overwrite=overwrite)
+    summary = ingest.run(data_dir, manifest_path)
+    print(f"Ingest finished: {json.dumps(summary)}")
+    return summary
@@ -0,0 +1,87 @@
+import contextlib
+import threading
+import time
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class _Stage:
+    """Context manager timing one pass through a stage."""
+
+    __slots__ = ("recorder", "name", "start")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation:
+    """
+    Per-stage wall time, call counts and latency histograms.
+
+    While disabled, `stage()` hands out one shared no-op context manager and
+    nothing is recorded, so instrumented code paths pay only for the call.
+    """
+
+    # Histogram bucket upper bounds in milliseconds; the last bucket is open-ended
+    BUCKETS_MS = [0.01, 0.1, 1, 10, 100, 1000]
+
+    def __init__(self):
+        self.enabled = False
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """Returns a context manager that times the enclosed block under `name`."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        """Adds one timing to a stage."""
+        milliseconds = seconds * 1000
+        bucket = next((idx for idx, bound in enumerate(self.BUCKETS_MS) if milliseconds <= bound), len(self.BUCKETS_MS))
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                             "histogram": [0] * (len(self.BUCKETS_MS) + 1)}
+            stats["count"] += 1
+            stats["total_ms"] += milliseconds
+            stats["max_ms"] = max(stats["max_ms"], milliseconds)
+            stats["histogram"][bucket] += 1
+
+    def snapshot(self):
+        """Returns a copy of the recorded statistics keyed by stage."""
+        with self._lock:
+            return {name: dict(stats, histogram=list(stats["histogram"])) for name, stats in self._stats.items()}
+
+    def reset(self):
+        """Drops all recorded statistics."""
+        with self._lock:
+            self._stats.clear()
+
+    def report(self):
+        """Formats the recorded statistics as a table, slowest stage first."""
+        stats = self.snapshot()
+        if not stats:
+            return "No stages recorded."
+        labels = [f"<={bound}ms" for bound in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+        lines = [f"{'stage':<20} {'count':>8} {'total ms':>11} {'mean ms':>9} {'max ms':>9}  histogram ({' '.join(labels)})"]
+        for name, stage in sorted(stats.items(), key=lambda item: item[1]["total_ms"], reverse=True):
+            mean = stage["total_ms"] / stage["count"]
+            histogram = " ".join(str(count) for count in stage["histogram"])
+            lines.append(f"{name:<20} {stage['count']:>8} {stage['total_ms']:>11.3f} {mean:>9.4f} {stage['max_ms']:>9.3f}  {histogram}")
+        return "\n".join(lines)
+
+
+# Shared by every ChatDB instance in the process so batch workers report together
+instrumentation = Instrumentation()
@@ -1,14 +1,97 @@
-from db_main.db_setup import ChatDB 
+import argparse
+import json
+from db_main.session import SessionManager
 
-def main():
+def parse_args(argv=None):
+    """Parses the command-line options; without --batch, --ingest, --snapshot or --serve the interactive menu is started."""
+    parser = argparse.ArgumentParser(description="ChatDB - querying historical stock data")
+    parser.add_argument("--cred", default="db_cred.json", help="Path to the database credentials file")
+    parser.add_argument("--db", type=int, help="Index of the database to connect to (1-based)")
+    parser.add_argument("--batch", metavar="FILE", help="Translate (table, question) records from a JSON-lines/CSV file, or - for stdin")
+    parser.add_argument("--execute", action="store_true", help="In batch mode, also execute the generated SQL")
+    parser.add_argument("--workers", type=int, default=4, help="Number of batch worker threads or ingest connections")
+    parser.add_argument("--output", default="-", help="Batch results file (JSON lines), or - for stdout")
+    parser.add_argument("--max-rows", type=int, default=100, help="Rows kept per executed batch query")
+    parser.add_argument("--ingest", metavar="DIR", help="Load every CSV in a directory into tables named after the files")
+    parser.add_argument("--manifest", help="Ingest progress file used to resume (default DIR/.ingest_manifest.json)")
+    parser.add_argument("--overwrite", action="store_true", help="Let an ingest replace tables that already exist")
+    parser.add_argument("--snapshot", metavar="OUT_DIR", help="Write every table of --db as memory-mappable NumPy columns")
+    parser.add_argument("--from-csv", metavar="DIR", help="With --snapshot, convert the CSVs under DIR instead of tables")
+    parser.add_argument("--serve", action="store_true", help="Run the JSON HTTP service for every configured database")
+    parser.add_argument("--host", default="127.0.0.1", help="Service address (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Service port (default 8765)")
+    parser.add_argument("--socket", metavar="PATH", help="Serve on a Unix socket instead of a TCP port")
+    parser.add_argument("--pool-size", type=int, default=4, help="Service connections per database")
+    parser.add_argument("--max-pending", type=int, default=64, help="Service requests admitted before answering 503")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Service request timeout in seconds")
+    parser.add_argument("--profile", nargs="?", const="chatdb.prof", metavar="FILE",
+                        help="Time each stage and run under cProfile, dumping the stats to FILE (default chatdb.prof)")
+    return parser.parse_args(argv)
+
+def profile_run(args):
+    """Runs the CLI with stage timing and cProfile enabled, then prints both reports to stderr."""
+    import cProfile
+    import pstats
+    import sys
+    from db_main.instrument import instrumentation
+
+    instrumentation.enabled = True
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run, args)
+    finally:
+        instrumentation.enabled = False
+        profiler.dump_stats(args.profile)
+        print("\nStage timings:", file=sys.stderr)
+        print(instrumentation.report(), file=sys.stderr)
+        print(f"\ncProfile stats written to {args.profile}; top functions by cumulative time:", file=sys.stderr)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(15)
+
+def main(argv=None):
     """Main function for the ChatDB CLI."""
+    args = parse_args(argv)
+    if args.profile:
+        profile_run(args)
+    else:
+        run(args)
+
+def run(args):
+    """Runs batch mode or the interactive menu for the parsed options."""
+    cred_json = args.cred
+    if args.batch:
+        from db_main.batch import run_batch
+        run_batch(cred_json, (args.db or 1) - 1, args.batch, args.output,
+                  execute=args.execute, workers=args.workers, max_rows=args.max_rows)
+        return
+    if args.ingest:
+        from db_main.ingest import run_ingest
+        run_ingest(cred_json, (args.db or 1) - 1, args.ingest, manifest_path=args.manifest,
+                   connections=args.workers, overwrite=args.overwrite)
+        return
+    if args.snapshot:
+        from db_main.snapshot import run_snapshot
+        run_snapshot(cred_json, (args.db or 1) - 1, args.snapshot, csv_dir=args.from_csv)
+        return
+    if args.serve:
+        from db_main.service import run_service
+        run_service(cred_json, args.host, args.port, args.socket, pool_size=args.pool_size,
+                    max_pending=args.max_pending, timeout=args.timeout)
+        return
+
+    print("\n----------------------------CHATDB 95 – QUERYING HISTORICAL STOCK DATA----------------------------\n")
+    with open(cred_json, 'r') as file:
+        databases = json.load(file).get("db_cred", [])
+
     print("Choose a database to connect to:")
-    print("1: stock_mag7")
-    print("2: etf_indexes")
-    print("3: etf_biotech_top3")
+    for idx, db_info in enumerate(databases, start=1):
+        print(f"{idx}: {db_info.get('name', db_info.get('db_name'))}")
     
-    db_index = int(input("Enter the index of the database (1-3): ")) - 1
-    chatdb = ChatDB("db_cred.json", db_index)
+    if args.db:
+        db_index = args.db - 1
+    else:
+        db_index = int(input(f"Enter the index of the database (1-{len(databases)}): ")) - 1
+    sessions = SessionManager(cred_json)
+    chatdb = sessions.switch(db_index)
     print("\n-----------------------------------------------------------------------------------------\n")
     print("Welcome to ChatDB! - QUERYING HISTORICAL STOCK DATA")
     while True:
@@ -18,7 +101,12 @@ def main():
         print("3. Convert natural language to SQL")
         print("4. Execute a query")
         print("5. Upload a dataset")
-        print("6. Exit")
+        print("6. Migrate a TEXT table to typed columns")
+        print("7. Build the unified prices table from every ticker table")
+        print("8. Compute column statistics for a table")
+        print("9. Switch to another database")
+        print("10. Run a query or question on every database")
+        print("11. Exit")
 
         choice = input("\nYour choice: ")
         if choice == "1":
@@ -27,32 +115,32 @@ def main():
             chatdb.suggest_queries()
         elif choice == "3":
             # List the tables
-            cursor = chatdb.conn.cursor()
-            cursor.execute("SHOW TABLES")
-            tables = cursor.fetchall()
+            tables = chatdb.catalog.tables()
 
             print("\nTables in the database:")
             for idx, table in enumerate(tables, start=1):
-                print(f"{idx} - {table[0]}")
+                print(f"{idx} - {table}")
 
             while True:
                 try:
                     choice = int(input(f"\nYour choice of the table to explore (1 to {len(tables)}): "))
                     if 1 <= choice <= len(tables):  # Validate range
-                        table_name = tables[choice - 1][0]  # Extract table name
+                        table_name = tables[choice - 1]  # Extract table name
                         break
                     else:
                         print(f"Invalid choice. Please enter a number between 1 and {len(tables)}.")
                 except ValueError:
                     print("Invalid input. Please enter a valid number.")
 
-            cursor.execute(f"DESCRIBE {table_name}")
-            columns = [col[0] for col in cursor.fetchall()]
+            columns = chatdb.catalog.columns(table_name)
 
             print(f"\nColumns in `{table_name}`: {', '.join(columns)}")
             nl_query = input("Enter your natural language query: ")
             sql_query = chatdb.natural_language_to_sql(nl_query, table_name, columns)
             print(f"Generated SQL: {sql_query}")
+            estimate = chatdb.estimate_result_rows(sql_query)
+            if estimate is not None:
+                print(f"Estimated result rows: {estimate}")
 
         elif choice == "4":
             chatdb.execute_query()
@@ -60,11 +148,45 @@ def main():
         elif choice == "5":
             file_path = input("Enter the CSV file path: ")
             table_name = input("Enter the table name to store the dataset: ")
-            chatdb.upload_dataset(file_path, table_name)
+            rollups = input("Build weekly/monthly/yearly rollup tables? (y/n): ").strip().lower() == "y"
+            facts = input("Add the rows to the unified prices table? (y/n): ").strip().lower() == "y"
+            chatdb.upload_dataset(file_path, table_name, rollups=rollups, facts=facts)
 
         elif choice == "6":
+            table_name = input("Enter the table name to migrate: ")
+            chatdb.migrate_table_types(table_name)
+
+        elif choice == "7":
+            chatdb.sync_fact_table()
+
+        elif choice == "8":
+            table_name = input("Enter the table name to analyze: ")
+            chatdb.analyze_table(table_name)
+
+        elif choice == "9":
+            for idx in range(len(databases)):
+                status = " (current)" if idx == sessions.current_index else " (connected)" if idx in sessions.connected() else ""
+                print(f"{idx + 1}: {sessions.name(idx)}{status}")
+            try:
+                db_index = int(input(f"Enter the index of the database (1-{len(databases)}): ")) - 1
+                switched = sessions.switch(db_index)
+            except ValueError as e:
+                print(f"Invalid choice: {e}")
+                continue
+            if switched.conn:
+                chatdb = switched
+                print(f"Now using {sessions.name(db_index)}.")
+            else:
+                print(f"Still using {sessions.name(sessions.current_index)}.")
+
+        elif choice == "10":
+            text = input("Enter a SQL query or a natural language question: ")
+            tables = input("Tables to ask, comma-separated (press Enter for every ticker table): ").strip()
+            sessions.run_fan_out(text, [table.strip() for table in tables.split(",")] if tables else None)
+
+        elif choice == "11":
             print("Goodbye!")
-            chatdb.close_connection()
+            sessions.close()
             break
         else:
             print("Invalid choice. Please try again.")
@@ -0,0 +1,35 @@
+import re
+
+# Single-quoted literals are skipped when looking for placeholders
+QUOTED_REGEX = r"'(?:[^'\\]|\\.|'')*'"
+
+
+def split_template(template, placeholder):
+    """Splits a SQL template at its placeholders, ignoring any inside quoted literals."""
+    parts, last = [], 0
+    for match in re.finditer(f"{QUOTED_REGEX}|{re.escape(placeholder)}", template):
+        if match.group(0) == placeholder:
+            parts.append(template[last:match.start()])
+            last = match.end()
+    parts.append(template[last:])
+    return parts
+
+
+def sql_literal(value):
+    """Renders a bound value as a SQL literal: NULL, a bare number, or a quoted string."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def inline_params(template, params, placeholder):
+    """Returns the template with its parameters written in as literals, for display and result-cache keys."""
+    parts = split_template(template, placeholder)
+    if len(parts) - 1 != len(params):
+        raise ValueError(f"The template has {len(parts) - 1} placeholders but {len(params)} parameters were given.")
+    pieces = [parts[0]]
+    for value, part in zip(params, parts[1:]):
+        pieces += [sql_literal(value), part]
+    return "".join(pieces)
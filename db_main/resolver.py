@@ -0,0 +1,104 @@
+from functools import lru_cache
+
+
+# Common names for price columns, mapped to candidate columns in order of preference
+COLUMN_SYNONYMS = {
+    "price": ["close"],
+    "closing": ["close"],
+    "closing_price": ["close"],
+    "close_price": ["close"],
+    "opening": ["open"],
+    "opening_price": ["open"],
+    "open_price": ["open"],
+    "adj": ["adj close", "adj_close"],
+    "adjusted": ["adj close", "adj_close"],
+    "adjusted_close": ["adj close", "adj_close"],
+    "adjusted_price": ["adj close", "adj_close"],
+    "vol": ["volume"],
+    "shares": ["volume"],
+    "traded_volume": ["volume"],
+    "day": ["date"],
+    "days": ["date"],
+    "time": ["date"],
+}
+
+
+class ColumnResolver:
+    """Resolves free-text terms to the column names of one table using prebuilt indexes."""
+
+    NGRAM = 3
+
+    def __init__(self, column_names, synonyms=None, cache_size=1024):
+        """Builds the name map, n-gram index and synonym table for a list of columns."""
+        self.column_names = list(column_names)
+        self.normalized = [col.lower() for col in self.column_names]
+
+        # Normalized name -> first column with that name
+        self._by_name = {}
+        for col, name in zip(self.column_names, self.normalized):
+            self._by_name.setdefault(name, col)
+
+        # Every substring up to NGRAM characters -> positions of the columns containing it
+        self._ngrams = {}
+        for idx, name in enumerate(self.normalized):
+            for size in range(1, self.NGRAM + 1):
+                for start in range(len(name) - size + 1):
+                    self._ngrams.setdefault(name[start:start + size], set()).add(idx)
+
+        self._synonyms = {}
+        for term, targets in (synonyms if synonyms is not None else COLUMN_SYNONYMS).items():
+            matches = [self._by_name[target] for target in targets if target in self._by_name]
+            if matches:
+                self._synonyms[term] = matches[0]
+
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _resolve(self, term):
+        """Returns the column for a term, or the normalized term if nothing matches."""
+        term_normalized = term.lower().replace(' ', '_')
+
+        # Step 1: Exact match
+        if term_normalized in self._by_name:
+            return self._by_name[term_normalized]
+
+        # Step 2: Known synonyms such as "price" -> Close
+        if term_normalized in self._synonyms:
+            return self._synonyms[term_normalized]
+
+        # Step 3: First column that contains the term as a substring
+        candidates = self._candidates(term_normalized)
+        for idx in sorted(candidates):
+            if term_normalized in self.normalized[idx]:
+                return self.column_names[idx]
+
+        from difflib import get_close_matches
+
+        # Step 4: Fuzzy matching, scoring the columns sharing a bigram with the term first
+        # and only falling back to every column when none of those is close enough
+        pool = self._fuzzy_pool(term_normalized)
+        matches = get_close_matches(term_normalized, pool, n=1, cutoff=0.5)
+        if not matches and len(pool) < len(self._by_name):
+            matches = get_close_matches(term_normalized, list(self._by_name), n=1, cutoff=0.5)
+        if matches:
+            return self._by_name[matches[0]]
+
+        # Step 5: No match, return normalized term
+        return term_normalized
+
+    def _candidates(self, term):
+        """Returns positions of the columns containing every n-gram of the term."""
+        size = min(len(term), self.NGRAM)
+        if size == 0:
+            return set()
+        grams = {term[start:start + size] for start in range(len(term) - size + 1)}
+        postings = sorted((self._ngrams.get(gram, set()) for gram in grams), key=len)
+        return set.intersection(*postings) if postings else set()
+
+    def _fuzzy_pool(self, term):
+        """Returns the distinct normalized names sharing a bigram with the term, or all of them."""
+        positions = set()
+        for start in range(len(term) - 1):
+            positions |= self._ngrams.get(term[start:start + 2], set())
+        if not positions:
+            return list(self._by_name)
+        return list(dict.fromkeys(self.normalized[idx] for idx in sorted(positions)))
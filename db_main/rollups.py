@@ -0,0 +1,173 @@
+import datetime
+import re
+
+# Rollup granularities from finest to coarsest, with the words that ask for them
+GRANULARITIES = {
+    "weekly": ["week", "weeks", "weekly"],
+    "monthly": ["month", "months", "monthly"],
+    "yearly": ["year", "years", "yearly", "annual", "annually"],
+}
+BUCKET_WORDS = {word: granularity for granularity, words in GRANULARITIES.items() for word in words}
+
+# How each standard price column is carried into a rollup period
+OHLCV_RULES = {
+    "open": "first",
+    "high": "max",
+    "low": "min",
+    "close": "last",
+    "adj close": "last",
+    "volume": "sum",
+}
+
+# Per-column partial aggregates stored next to OHLCV so SUM/AVG/MIN/MAX/COUNT can be answered exactly
+PARTIALS = ["sum", "min", "max", "count"]
+
+
+def rollup_table_name(table_name, granularity):
+    """Returns the name of a table's rollup, e.g. `aapl_monthly`."""
+    return f"{table_name}_{granularity}"
+
+
+def rollup_columns(column_names):
+    """Returns the standard price columns of a table, in table order."""
+    return [col for col in column_names if col.lower() in OHLCV_RULES]
+
+
+def period_start(granularity, date_text):
+    """Returns the first day ('YYYY-MM-DD') and the label of the period containing a date."""
+    day = datetime.date.fromisoformat(str(date_text)[:10])
+    if granularity == "weekly":
+        start = day - datetime.timedelta(days=day.weekday())
+        return start.isoformat(), start.isoformat()
+    if granularity == "monthly":
+        return day.replace(day=1).isoformat(), day.strftime("%Y-%m")
+    return day.replace(month=1, day=1).isoformat(), day.strftime("%Y")
+
+
+def build_rollup_statements(backend, table_name, granularity, date_column, price_columns, since=None):
+    """
+    Returns the SQL statements that (re)create one rollup table from its base table.
+
+    With `since`, the rollup is kept and only the periods from the one containing that
+    date onward are deleted and recomputed, reading base rows through the Date key.
+    """
+    rollup = rollup_table_name(table_name, granularity)
+    period = backend.period_expression(granularity, f"`{date_column}`")
+
+    column_defs = ["`period` VARCHAR(10) NOT NULL", "`first_date` DATE", "`last_date` DATE", "`row_count` BIGINT"]
+    for col in price_columns:
+        column_defs.append(f"`{col}` {'BIGINT' if OHLCV_RULES[col.lower()] == 'sum' else 'DOUBLE'}")
+    for col in price_columns:
+        column_defs += [f"`{col}_{partial}` {'BIGINT' if partial == 'count' else 'DOUBLE'}" for partial in PARTIALS]
+    column_defs.append("PRIMARY KEY (`period`)")
+
+    # Group once, then join the first and last row of every period to pick Open/Close
+    grouped = [f"{period} AS period", f"MIN(`{date_column}`) AS first_date",
+               f"MAX(`{date_column}`) AS last_date", "COUNT(*) AS row_count"]
+    selected = ["g.period", "g.first_date", "g.last_date", "g.row_count"]
+    for col in price_columns:
+        rule = OHLCV_RULES[col.lower()]
+        if rule == "first":
+            selected.append(f"f.`{col}`")
+        elif rule == "last":
+            selected.append(f"l.`{col}`")
+        else:
+            selected.append(f"g.`{col}_{rule}`")
+    for col in price_columns:
+        for partial in PARTIALS:
+            grouped.append(f"{partial.upper()}(`{col}`) AS `{col}_{partial}`")
+            selected.append(f"g.`{col}_{partial}`")
+
+    target_columns = ["period", "first_date", "last_date", "row_count"] + price_columns
+    target_columns += [f"{col}_{partial}" for col in price_columns for partial in PARTIALS]
+    where = ""
+    if since is None:
+        statements = [
+            f"DROP TABLE IF EXISTS `{rollup}`",
+            f"CREATE TABLE `{rollup}` ({', '.join(column_defs)})",
+        ]
+    else:
+        start, label = period_start(granularity, since)
+        statements = [f"DELETE FROM `{rollup}` WHERE `period` >= '{label}'"]
+        where = f" WHERE `{date_column}` >= '{start}'"
+    statements.append(
+        f"INSERT INTO `{rollup}` ({', '.join(f'`{col}`' for col in target_columns)}) "
+        f"SELECT {', '.join(selected)} FROM "
+        f"(SELECT {', '.join(grouped)} FROM `{table_name}`{where} GROUP BY {period}) AS g "
+        f"JOIN `{table_name}` AS f ON f.`{date_column}` = g.first_date "
+        f"JOIN `{table_name}` AS l ON l.`{date_column}` = g.last_date"
+    )
+    return statements
+
+
+AGGREGATE_QUERY_REGEX = re.compile(
+    r"^\s*select\s+(?:(?P<bucket>.+?)\s+as\s+`?(?P<alias>\w+)`?\s*,\s*)?"
+    r"(?P<func>sum|avg|min|max|count)\s*\(\s*(?P<column>\*|`[^`]+`|[\w ]+?)\s*\)\s+"
+    r"from\s+`?(?P<table>\w+)`?"
+    r"(?:\s+group\s+by\s+(?P<group>.+?))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def partial_expression(func, column):
+    """Rewrites one aggregate over base rows as an exact aggregate over rollup rows."""
+    if column == "*":
+        return "SUM(`row_count`)" if func == "COUNT" else None
+    return {
+        "SUM": f"SUM(`{column}_sum`)",
+        "MIN": f"MIN(`{column}_min`)",
+        "MAX": f"MAX(`{column}_max`)",
+        "COUNT": f"SUM(`{column}_count`)",
+        "AVG": f"SUM(`{column}_sum`) / SUM(`{column}_count`)",
+    }[func]
+
+
+def route_to_rollup(sql_query, backend, date_column, price_columns, available_rollups):
+    """
+    Rewrites a single-aggregate query over a base table to read the smallest rollup that
+    answers it exactly. Returns (sql, rollup table) or (None, None) when it is not eligible.
+
+    Eligible shapes are `SELECT AGG(col) FROM t` (served by the yearly rollup, or the
+    coarsest one available) and `SELECT <period> AS x, AGG(col) FROM t GROUP BY <period>`
+    where <period> is the backend's weekly/monthly/yearly bucket of the Date column.
+    """
+    match = AGGREGATE_QUERY_REGEX.match(sql_query)
+    if not match:
+        return None, None
+    func = match.group("func").upper()
+    column = match.group("column").strip("`")
+    table_name = match.group("table")
+    known_columns = {col.lower(): col for col in price_columns}
+    if column != "*" and column.lower() not in known_columns:
+        return None, None
+    column = known_columns.get(column.lower(), column)
+    aggregate = partial_expression(func, column)
+    if aggregate is None:
+        return None, None
+    label = f"`{match.group('func')}({match.group('column')})`"
+
+    bucket, group = match.group("bucket"), match.group("group")
+    if bucket is None and group is None:
+        # Whole-table aggregate: any rollup answers it, the coarsest one has the fewest rows
+        for granularity in reversed(list(GRANULARITIES)):
+            rollup = rollup_table_name(table_name, granularity)
+            if rollup in available_rollups:
+                return f"SELECT {aggregate} AS {label} FROM `{rollup}`;", rollup
+        return None, None
+    if bucket is None or group is None:
+        return None, None
+
+    # Grouped by a period bucket: only the rollup of the same granularity lines up exactly
+    for granularity in GRANULARITIES:
+        expression = backend.period_expression(granularity, f"`{date_column}`")
+        bare_expression = backend.period_expression(granularity, date_column)
+        if bucket.strip() not in (expression, bare_expression):
+            continue
+        if group.strip().strip("`") not in (expression, bare_expression, match.group("alias")):
+            return None, None
+        rollup = rollup_table_name(table_name, granularity)
+        if rollup not in available_rollups:
+            return None, None
+        alias = match.group("alias")
+        return f"SELECT `period` AS {alias}, {aggregate} AS {label} FROM `{rollup}` GROUP BY `period`;", rollup
+    return None, None
@@ -0,0 +1,371 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from db_main.cache import ResultCache, written_table
+from db_main.db_setup import ChatDB
+from db_main.prepared import inline_params
+
+MAX_BODY_BYTES = 1024 * 1024
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+UPLOAD_MODES = ["cancel", "append", "overwrite"]
+
+
+class ServiceError(Exception):
+    """An error answered with an HTTP status and a JSON `error` message."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ChatDBPool:
+    """Up to `size` connected ChatDB instances for one database, created on demand and lent out one per request."""
+
+    def __init__(self, cred_json, db_index, size, result_cache, executor):
+        """Keeps the pool settings; no connection is opened until the first request."""
+        self.cred_json = cred_json
+        self.db_index = db_index
+        self.size = size
+        self.result_cache = result_cache
+        self.executor = executor
+        self.members = []
+        self._idle = asyncio.Queue()
+        self._created = 0
+
+    def _connect(self):
+        """Opens one pool member; runs in a worker thread."""
+        chatdb = ChatDB(self.cred_json, self.db_index, result_cache=self.result_cache)
+        chatdb.debug = False
+        return chatdb
+
+    def _adopt(self, future):
+        """Keeps a connection whose requester gave up while it was being opened."""
+        if not future.cancelled() and future.exception() is None and future.result().conn:
+            self.members.append(future.result())
+            self.release(future.result())
+        else:
+            self._created -= 1
+
+    async def acquire(self):
+        """Returns an idle member, opening a new one while under `size`, otherwise waits for one."""
+        if not self._idle.empty() or self._created >= self.size:
+            return await self._idle.get()
+        self._created += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self._connect)
+        try:
+            chatdb = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(self._adopt)
+            raise
+        except Exception:
+            self._created -= 1
+            raise
+        if not chatdb.conn:
+            self._created -= 1
+            raise ServiceError(503, f"Could not connect to database {self.db_index + 1}.")
+        self.members.append(chatdb)
+        return chatdb
+
+    def release(self, chatdb):
+        """Returns a member to the pool."""
+        self._idle.put_nowait(chatdb)
+
+    def invalidate(self, table_name=None):
+        """Drops cached schema of a table (or all tables) on every member after a change."""
+        for chatdb in self.members:
+            chatdb.catalog.invalidate(table_name)
+
+    def stats(self):
+        """Returns the pool's size and usage."""
+        return {"size": self.size, "connected": self._created, "idle": self._idle.qsize()}
+
+    def close(self):
+        """Closes every member's connection."""
+        for chatdb in self.members:
+            chatdb.close_connection()
+
+
+class ChatDBService:
+    """
+    JSON-over-HTTP service exposing translate, execute, explore and upload for the
+    databases of a credentials file.
+
+    Requests run in worker threads on a pool of at most `pool_size` connections per
+    database. Beyond `max_pending` admitted requests new ones get 503, every request is
+    bounded by `timeout` seconds (504), and a running request can be cancelled through
+    `/cancel` with the `request_id` it was sent with (409).
+    """
+
+    def __init__(self, cred_json, pool_size=4, max_pending=64, timeout=30.0, max_rows=10000):
+        """Reads the configured databases; pools are created on first use."""
+        with open(cred_json, "r") as file:
+            self.databases = json.load(file).get("db_cred", [])
+        self.cred_json = cred_json
+        self.pool_size = pool_size
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.result_cache = ResultCache()
+        self.executor = ThreadPoolExecutor(max_workers=pool_size * max(1, len(self.databases)) + 4)
+        self._cancel_executor = ThreadPoolExecutor(max_workers=2)
+        self._pools = {}
+        self._pending = 0
+        self._running = {}
+        self.routes = {
+            "/translate": self._translate,
+            "/execute": self._execute,
+            "/explore": self._explore,
+            "/upload": self._upload,
+        }
+
+    def _pool(self, db):
+        """Returns the pool of a 1-based database number, creating it on first use."""
+        if not isinstance(db, int) or not 1 <= db <= len(self.databases):
+            raise ServiceError(404, f"Unknown database {db!r}. Expected 1 to {len(self.databases)}.")
+        if db not in self._pools:
+            db_info = self.databases[db - 1]
+            # Every connection to an in-memory SQLite database is a separate database
+            in_memory = db_info.get("backend") == "sqlite" and db_info.get("path", ":memory:") == ":memory:"
+            size = 1 if in_memory else self.pool_size
+            self._pools[db] = ChatDBPool(self.cred_json, db - 1, size, self.result_cache, self.executor)
+        return self._pools[db]
+
+    def _cancel_statement(self, chatdb):
+        """Aborts whatever a pool member is running; errors only mean there was nothing to abort."""
+        try:
+            chatdb.backend.cancel(chatdb.conn)
+        except Exception as e:
+            print(f"The error '{e}' occurred while cancelling a query")
+
+    async def _run(self, pool, operation, body):
+        """Runs operation(chatdb, body) on a pooled connection in a worker thread."""
+        loop = asyncio.get_running_loop()
+        chatdb = await pool.acquire()
+        future = loop.run_in_executor(self.executor, operation, chatdb, body)
+
+        def finished(done):
+            if not done.cancelled():
+                done.exception()  # Retrieved here too, since a cancelled request no longer awaits it
+            pool.release(chatdb)
+
+        future.add_done_callback(finished)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The thread cannot be stopped, so abort its statement; the member returns to the pool once it ends
+            if not future.done():
+                loop.run_in_executor(self._cancel_executor, self._cancel_statement, chatdb)
+            raise
+
+    async def dispatch(self, method, path, body):
+        """Handles one request and returns (status, JSON-serializable payload)."""
+        if path == "/health":
+            return 200, {
+                "pending": self._pending,
+                "pools": {str(db): pool.stats() for db, pool in self._pools.items()},
+                "cache": self.result_cache.stats(),
+            }
+        if method != "POST":
+            return 405, {"error": "Use POST with a JSON body."}
+        try:
+            request = json.loads(body or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("expected an object")
+        except ValueError as e:
+            return 400, {"error": f"Invalid JSON body: {e}"}
+        if path == "/cancel":
+            task = self._running.get(request.get("request_id"))
+            if task is not None:
+                task.cancel()
+            return 200, {"cancelled": task is not None}
+        operation = self.routes.get(path)
+        if operation is None:
+            return 404, {"error": f"Unknown endpoint '{path}'."}
+        if self._pending >= self.max_pending:
+            return 503, {"error": "Too many pending requests, retry later."}
+
+        self._pending += 1
+        request_id = request.get("request_id")
+        try:
+            pool = self._pool(request.get("db", 1))
+            task = asyncio.ensure_future(asyncio.wait_for(self._run(pool, operation, request), self.timeout))
+            if request_id is not None:
+                self._running[request_id] = task
+            try:
+                await asyncio.wait({task})
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            if task.cancelled():
+                return 409, {"error": "Request was cancelled."}
+            error = task.exception()
+            if isinstance(error, asyncio.TimeoutError):
+                return 504, {"error": f"Request timed out after {self.timeout} s."}
+            if error is not None:
+                raise error
+            if path == "/upload" or (path == "/execute" and written_table(request["sql"])):
+                pool.invalidate()
+            return 200, task.result()
+        except ServiceError as e:
+            return e.status, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"The error '{e}' occurred"}
+        finally:
+            self._pending -= 1
+            if request_id is not None:
+                self._running.pop(request_id, None)
+
+    @staticmethod
+    def _required(body, *names):
+        """Returns the named string fields of a request, raising 400 when one is missing."""
+        missing = [name for name in names if not isinstance(body.get(name), str) or not body[name].strip()]
+        if missing:
+            raise ServiceError(400, f"Missing field(s): {', '.join(missing)}.")
+        return [body[name].strip() for name in names]
+
+    def _columns(self, chatdb, table_name):
+        """Returns a table's columns, raising 404 for unknown tables."""
+        columns = chatdb.catalog.columns(table_name)
+        if not columns:
+            raise ServiceError(404, f"Unknown table '{table_name}'.")
+        return columns
+
+    def _translate(self, chatdb, body):
+        """POST /translate {"db", "table", "question"} -> {"sql", "template", "params", "estimated_rows"}"""
+        table_name, question = self._required(body, "table", "question")
+        sql_query, params = chatdb.natural_language_to_template(question, table_name, self._columns(chatdb, table_name))
+        if not sql_query.upper().startswith("SELECT"):
+            raise ServiceError(400, sql_query)
+        return {"sql": inline_params(sql_query, params, chatdb.backend.placeholder), "template": sql_query, "params": params,
+                "estimated_rows": chatdb.estimate_result_rows(sql_query, params)}
+
+    def _execute(self, chatdb, body):
+        """
+        POST /execute {"db", "sql", "params", "max_rows"} -> {"columns", "rows", "plan"} or {"rows_affected"}
+
+        With "params", "sql" is a template such as the "template" returned by /translate.
+        """
+        (sql_query,) = self._required(body, "sql")
+        max_rows = min(int(body.get("max_rows") or self.max_rows), self.max_rows)
+        params = body.get("params")
+        if params is not None and not isinstance(params, list):
+            raise ServiceError(400, "params must be a list.")
+        try:
+            columns, rows = chatdb.fetch_query(sql_query, max_rows, params)
+        except ValueError as e:
+            # QueryRefused by the cost guard, or params that do not fit the template
+            raise ServiceError(400, str(e))
+        except chatdb.backend.error_types() as e:
+            chatdb.conn.rollback()
+            raise ServiceError(400, str(e))
+        if columns is None:
+            return {"rows_affected": rows}
+        return {"columns": list(columns), "rows": [list(row) for row in rows], "plan": chatdb.last_plan}
+
+    def _explore(self, chatdb, body):
+        """POST /explore {"db", "table"} -> every table's columns, or one table's columns and sample rows"""
+        if not body.get("table"):
+            return {"tables": {table: chatdb.catalog.column_types(table) for table in chatdb.catalog.tables()}}
+        (table_name,) = self._required(body, "table")
+        self._columns(chatdb, table_name)
+        _, rows = chatdb.fetch_query(f"SELECT * FROM `{table_name}` LIMIT 5")
+        return {"columns": chatdb.catalog.column_types(table_name), "sample": [list(row) for row in rows]}
+
+    def _upload(self, chatdb, body):
+        """POST /upload {"db", "file_path", "table", "if_exists", "rollups", "facts"} -> {"rows"}"""
+        file_path, table_name = self._required(body, "file_path", "table")
+        if_exists = body.get("if_exists", "cancel")
+        if if_exists not in UPLOAD_MODES:
+            raise ServiceError(400, f"if_exists must be one of: {', '.join(UPLOAD_MODES)}.")
+        rows = chatdb.upload_dataset(file_path, table_name, if_exists=if_exists,
+                                     rollups=bool(body.get("rollups")), facts=bool(body.get("facts")))
+        if rows is None:
+            raise ServiceError(400, f"Nothing was uploaded to '{table_name}'; see the service log.")
+        return {"table": table_name, "rows": rows}
+
+    async def handle_connection(self, reader, writer):
+        """Serves HTTP/1.1 requests on one client connection, keeping it alive between requests."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Malformed request."}, False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "Request body too large."}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self.dispatch(method.upper(), target.split("?", 1)[0], body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, payload, keep_alive):
+        """Writes one JSON response."""
+        body = json.dumps(payload, default=str).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8765, socket_path=None):
+        """Listens on a TCP port, or on a Unix socket when `socket_path` is given, until cancelled."""
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+            print(f"ChatDB service listening on unix:{socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"ChatDB service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        """Closes every pooled connection and stops the worker threads."""
+        for pool in self._pools.values():
+            pool.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self._cancel_executor.shutdown(wait=False)
+
+
+def run_service(cred_json, host="127.0.0.1", port=8765, socket_path=None, **options):
+    """Runs the service until interrupted."""
+    service = ChatDBService(cred_json, **options)
+    try:
+        asyncio.run(service.serve(host, port, socket_path))
+    except KeyboardInterrupt:
+        print("Service stopped.")
+    finally:
+        service.close()
@@ -0,0 +1,198 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_main.cache import ResultCache
+from db_main.db_setup import ChatDB
+from db_main.facts import FACT_TABLE
+from db_main.frames import frame_from_batches
+from db_main.guard import QueryRefused
+from db_main.prepared import inline_params
+from db_main.rollups import GRANULARITIES, rollup_table_name
+
+DATABASE_COLUMN = "database"
+TABLE_COLUMN = "table"
+
+
+def merge_results(parts, label_columns):
+    """
+    Merges per-source (labels, columns, rows) results into one (columns, rows) result set.
+    Every row is prefixed with its labels; columns are the union of the sources' columns in
+    first-seen order, and a source without a column gets None in it.
+    """
+    columns = []
+    for _, part_columns, _ in parts:
+        columns += [col for col in part_columns if col not in columns]
+    rows = []
+    for labels, part_columns, part_rows in parts:
+        positions = [part_columns.index(col) if col in part_columns else None for col in columns]
+        rows += [tuple(labels) + tuple(None if pos is None else row[pos] for pos in positions) for row in part_rows]
+    return list(label_columns) + columns, rows
+
+
+class SessionManager:
+    """
+    The databases of a credentials file behind one session. Connections are opened on
+    first use and kept, so switching databases does not reconnect, and a query or natural
+    language question can be fanned out to every database at once: each database runs on
+    its own worker thread and the results are merged, so a fan-out takes as long as the
+    slowest database rather than the sum of all of them.
+    """
+
+    def __init__(self, cred_json, result_cache=None):
+        """Reads the configured databases; nothing is connected until a database is used."""
+        with open(cred_json, "r") as file:
+            self.databases = json.load(file).get("db_cred", [])
+        self.cred_json = cred_json
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self.current_index = None
+        self._sessions = {}  # db_index -> connected ChatDB
+        self._locks = [threading.Lock() for _ in self.databases]  # One user of a connection at a time
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.databases)))
+
+    def name(self, db_index):
+        """Display name of a configured database."""
+        db_info = self.databases[db_index]
+        return db_info.get("name", db_info.get("db_name"))
+
+    def session(self, db_index):
+        """
+        Returns the ChatDB of a database, connecting on first use. A ChatDB that failed to
+        connect is returned but not kept, so the next call tries again.
+        """
+        if not 0 <= db_index < len(self.databases):
+            raise ValueError(f"Unknown database {db_index + 1}. Expected 1 to {len(self.databases)}.")
+        chatdb = self._sessions.get(db_index)
+        if chatdb is None:
+            chatdb = ChatDB(self.cred_json, db_index, result_cache=self.result_cache)
+            if chatdb.conn:
+                self._sessions[db_index] = chatdb
+        return chatdb
+
+    @property
+    def current(self):
+        """The ChatDB of the database switched to last, or None."""
+        return self._sessions.get(self.current_index)
+
+    def switch(self, db_index):
+        """Makes a database the current one and returns its ChatDB; a failed connection keeps the previous one."""
+        chatdb = self.session(db_index)
+        if chatdb.conn or self.current_index is None:
+            self.current_index = db_index
+        return chatdb
+
+    def connected(self):
+        """Indexes of the databases with an open connection."""
+        return sorted(self._sessions)
+
+    def _fan_out(self, work, databases=None):
+        """
+        Runs work(chatdb) -> [(labels, columns, rows)] for each database on the worker
+        threads. Returns the parts in database order and a report by database name with
+        the rows returned, the elapsed milliseconds and the error, if any.
+        """
+        databases = range(len(self.databases)) if databases is None else databases
+
+        def run(db_index):
+            start = time.perf_counter()
+            parts, error = [], None
+            with self._locks[db_index]:
+                chatdb = self.session(db_index)
+                if not chatdb.conn:
+                    error = "Could not connect."
+                else:
+                    debug, chatdb.debug = chatdb.debug, False
+                    try:
+                        parts = work(chatdb)
+                    except QueryRefused as e:
+                        error = str(e)
+                    except chatdb.backend.error_types() + (ValueError,) as e:
+                        error = f"The error '{e}' occurred"
+                    finally:
+                        chatdb.debug = debug
+            report = {"rows": sum(len(rows) for _, _, rows in parts),
+                      "ms": round((time.perf_counter() - start) * 1000, 3), "error": error}
+            return parts, report
+
+        futures = {db_index: self._executor.submit(run, db_index) for db_index in databases}
+        parts, report = [], {}
+        for db_index, future in futures.items():
+            db_parts, report[self.name(db_index)] = future.result()
+            parts += db_parts
+        return parts, report
+
+    def fan_out_query(self, query, databases=None, max_rows=None, params=None):
+        """
+        Runs one SQL query on every database (or the given indexes) concurrently. Returns
+        (columns, rows, report) with a leading `database` column; see `_fan_out` for the report.
+        """
+        def work(chatdb):
+            columns, rows = chatdb.fetch_query(query, max_rows, params)
+            return [([self.name(chatdb.db_index)], columns, rows)] if columns is not None else []
+
+        parts, report = self._fan_out(work, databases)
+        return (*merge_results(parts, [DATABASE_COLUMN]), report)
+
+    def question_tables(self, chatdb):
+        """Tables a question is asked of by default: every table except the prices fact table and rollups."""
+        tables = chatdb.catalog.tables()
+        rollups = {rollup_table_name(table, granularity) for table in tables for granularity in GRANULARITIES}
+        return [table for table in tables if table != FACT_TABLE and table not in rollups]
+
+    def fan_out_question(self, question, tables=None, databases=None, max_rows=None):
+        """
+        Translates a natural language question for each table of every database and runs the
+        generated queries, databases concurrently and tables in turn on each connection.
+        `tables` limits the tables (a database without any of them is skipped); by default
+        `question_tables` are used. Returns (columns, rows, report) with leading `database`
+        and `table` columns; the report also lists the generated SQL by table.
+        """
+        generated = {}
+
+        def work(chatdb):
+            names = self.question_tables(chatdb)
+            if tables:
+                wanted = {table.lower() for table in tables}
+                names = [table for table in names if table.lower() in wanted]
+            parts = []
+            for table in names:
+                sql_query, params = chatdb.natural_language_to_template(question, table, chatdb.catalog.columns(table))
+                if not sql_query.upper().startswith(("SELECT", "WITH")):
+                    raise ValueError(sql_query)
+                generated.setdefault(self.name(chatdb.db_index), {})[table] = inline_params(
+                    sql_query, params, chatdb.backend.placeholder)
+                columns, rows = chatdb.fetch_query(sql_query, max_rows, params)
+                parts.append(([self.name(chatdb.db_index), table], columns, rows))
+            return parts
+
+        parts, report = self._fan_out(work, databases)
+        for name, entry in report.items():
+            entry["sql"] = generated.get(name, {})
+        return (*merge_results(parts, [DATABASE_COLUMN, TABLE_COLUMN]), report)
+
+    def run_fan_out(self, text, tables=None, max_rows=None):
+        """Fans a SQL query or, for anything else, a natural language question out to every database and prints the merged results."""
+        start = time.perf_counter()
+        if text.strip().upper().startswith(("SELECT", "WITH")):
+            columns, rows, report = self.fan_out_query(text, max_rows=max_rows)
+        else:
+            columns, rows, report = self.fan_out_question(text, tables, max_rows=max_rows)
+        elapsed = (time.perf_counter() - start) * 1000
+        for name, entry in report.items():
+            status = f"error: {entry['error']}" if entry["error"] else f"{entry['rows']} rows"
+            print(f"{name}: {status} ({entry['ms']:.1f} ms)")
+        if rows:
+            print(frame_from_batches([rows], columns, compact=True).to_markdown(index=False))
+        print(f"{len(rows)} rows from {sum(1 for entry in report.values() if entry['rows'])} databases in {elapsed:.1f} ms "
+              f"(slowest database {max((entry['ms'] for entry in report.values()), default=0):.1f} ms, "
+              f"sum {sum(entry['ms'] for entry in report.values()):.1f} ms).")
+        return columns, rows, report
+
+    def close(self):
+        """Closes every open connection and stops the worker threads."""
+        for chatdb in self._sessions.values():
+            chatdb.close_connection()
+        self._sessions.clear()
+        self.current_index = None
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,247 @@
+import json
+import os
+import re
+import shutil
+import time
+
+from db_main.db_setup import ChatDB, table_name_from_file
+from db_main.rollups import GRANULARITIES
+
+# NumPy is imported inside the functions that need it, like pandas elsewhere
+SNAPSHOT_META = "meta.json"
+RESAMPLE_HOW = ["first", "last", "min", "max", "sum", "mean"]
+
+
+def _column_file(position, name):
+    """Returns the .npy file name of a column, e.g. `05_Adj_Close.npy`."""
+    stem = re.sub(r"\W+", "_", name).strip("_")
+    return f"{position:02d}_{stem}.npy"
+
+
+def _to_array(values, sql_type):
+    """Converts one column of Python values to a NumPy array suited to its SQL type."""
+    import numpy as np
+    sql_type = (sql_type or "").lower()
+    if sql_type in ("date", "datetime", "timestamp"):
+        return np.array([str(value)[:10] if value is not None else "NaT" for value in values], dtype="datetime64[D]")
+    if sql_type in ("bigint", "int", "integer", "smallint", "tinyint", "mediumint") and None not in values:
+        return np.array(values, dtype=np.int64)
+    if sql_type in ("double", "float", "real", "decimal", "numeric") or sql_type.endswith("int"):
+        return np.array([float(value) if value is not None else np.nan for value in values], dtype=np.float64)
+    return np.array(["" if value is None else str(value) for value in values])
+
+
+def write_snapshot(out_dir, name, columns, date_column=None, source=None):
+    """
+    Writes {column name: NumPy array} as one .npy file per column plus `meta.json` under
+    `out_dir/name`, replacing any previous snapshot of that name in one rename.
+    """
+    import numpy as np
+    target = os.path.join(out_dir, name)
+    staging = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    meta = {"name": name, "source": source, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "date_column": date_column, "rows": 0, "columns": []}
+    for position, (column, values) in enumerate(columns.items()):
+        file_name = _column_file(position, column)
+        np.save(os.path.join(staging, file_name), np.ascontiguousarray(values))
+        meta["columns"].append({"name": column, "file": file_name, "dtype": str(values.dtype)})
+        meta["rows"] = len(values)
+    with open(os.path.join(staging, SNAPSHOT_META), "w") as file:
+        json.dump(meta, file, indent=2)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.replace(staging, target)
+    return target
+
+
+def snapshot_table(chatdb, table_name, out_dir, batch_size=10000):
+    """Writes a database table, ordered by its Date column when it has one, as a snapshot."""
+    column_types = chatdb.catalog.column_types(table_name)
+    if not column_types:
+        raise ValueError(f"Unknown table '{table_name}'.")
+    date_column = chatdb._date_column(column_types)
+    order = f" ORDER BY `{date_column}`" if date_column else ""
+    cursor = chatdb.backend.streaming_cursor(chatdb.conn)
+    cursor.execute(f"SELECT * FROM `{table_name}`{order}")
+    values = [[] for _ in column_types]
+    for batch in chatdb._fetch_batches(cursor, batch_size, None):
+        for row in batch:
+            for position, value in enumerate(row):
+                values[position].append(value)
+    columns = {col: _to_array(column_values, sql_type) for (col, sql_type), column_values in zip(column_types, values)}
+    return write_snapshot(out_dir, table_name, columns, date_column, source=f"{chatdb.backend.db_name}.{table_name}")
+
+
+def snapshot_csv(file_path, out_dir, name=None):
+    """Writes a CSV as a snapshot, with a `Date` column parsed and sorted as the date index."""
+    import numpy as np
+    import pandas as pd
+    frame = pd.read_csv(file_path)
+    date_column = next((col for col in frame.columns if col.lower() == "date"), None)
+    if date_column:
+        frame[date_column] = pd.to_datetime(frame[date_column], errors="coerce")
+        frame = frame.sort_values(date_column, kind="stable")
+    columns = {}
+    for col in frame.columns:
+        series = frame[col]
+        if col == date_column:
+            columns[col] = series.to_numpy(dtype="datetime64[D]")
+        elif pd.api.types.is_integer_dtype(series):
+            columns[col] = series.to_numpy(dtype=np.int64)
+        elif pd.api.types.is_numeric_dtype(series):
+            columns[col] = series.to_numpy(dtype=np.float64)
+        else:
+            columns[col] = np.array(series.fillna("").astype(str).tolist())
+    return write_snapshot(out_dir, name or table_name_from_file(file_path), columns, date_column, source=file_path)
+
+
+def snapshot_database(chatdb, out_dir):
+    """Snapshots every table of a connected database; returns the written directories."""
+    return [snapshot_table(chatdb, table, out_dir) for table in chatdb.catalog.tables()]
+
+
+def snapshot_csv_tree(data_dir, out_dir):
+    """Snapshots every CSV under a directory tree, mirroring its subdirectories; returns the written directories."""
+    written = []
+    for root, _, files in sorted(os.walk(data_dir)):
+        relative = os.path.relpath(root, data_dir)
+        for file_name in sorted(files):
+            if file_name.lower().endswith(".csv"):
+                target_dir = out_dir if relative == "." else os.path.join(out_dir, relative)
+                written.append(snapshot_csv(os.path.join(root, file_name), target_dir))
+    return written
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot directory. Columns are memory-mapped on first use, so
+    opening is free, repeated reads share the OS page cache across processes, and the
+    analytics below run on the mapped arrays without copying them into Python objects.
+    """
+
+    def __init__(self, path):
+        """Reads `meta.json`; column data stays on disk until accessed."""
+        self.path = path
+        with open(os.path.join(path, SNAPSHOT_META), "r") as file:
+            self.meta = json.load(file)
+        self._files = {col["name"]: col["file"] for col in self.meta["columns"]}
+        self._by_lower = {name.lower(): name for name in self._files}
+        self._arrays = {}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    @property
+    def columns(self):
+        """Column names in table order."""
+        return list(self._files)
+
+    def column(self, name):
+        """Returns a column as a read-only memory-mapped array; names are matched case-insensitively."""
+        import numpy as np
+        name = self._by_lower.get(name.lower(), name)
+        if name not in self._files:
+            raise KeyError(f"Snapshot '{self.meta['name']}' has no column '{name}'.")
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, self._files[name]), mmap_mode="r")
+        return self._arrays[name]
+
+    @property
+    def dates(self):
+        """The datetime64[D] date index, or None when the snapshot has no Date column."""
+        date_column = self.meta.get("date_column")
+        return self.column(date_column) if date_column else None
+
+    def returns(self, column="Close", periods=1, log=False):
+        """Period-over-period returns; the first `periods` values are NaN."""
+        import numpy as np
+        values = self.column(column)
+        result = np.full(len(values), np.nan)
+        if log:
+            result[periods:] = np.log(values[periods:] / values[:-periods])
+        else:
+            result[periods:] = values[periods:] / values[:-periods] - 1
+        return result
+
+    def rolling_mean(self, column="Close", window=20):
+        """
+        Trailing mean over `window` rows from running sums; NaN until the first full window
+        and wherever the window holds a missing value.
+        """
+        import numpy as np
+        values = self.column(column)
+        result = np.full(len(values), np.nan)
+        if window <= len(values):
+            missing = np.isnan(values)
+            sums = np.cumsum(np.concatenate(([0.0], np.where(missing, 0.0, values))))
+            gaps = np.cumsum(np.concatenate(([0], missing)))
+            means = (sums[window:] - sums[:-window]) / window
+            result[window - 1:] = np.where(gaps[window:] == gaps[:-window], means, np.nan)
+        return result
+
+    def drawdown(self, column="Close"):
+        """Fractional distance below the running peak at every row (0 at a new high); missing values stay NaN."""
+        import numpy as np
+        values = self.column(column)
+        return values / np.fmax.accumulate(values) - 1
+
+    def max_drawdown(self, column="Close"):
+        """Returns (largest drawdown, peak date, trough date)."""
+        import numpy as np
+        drawdown = self.drawdown(column)
+        trough = int(np.nanargmin(drawdown))
+        peak = int(np.nanargmax(self.column(column)[:trough + 1]))
+        dates = self.dates
+        label = (lambda idx: str(dates[idx])) if dates is not None else (lambda idx: idx)
+        return float(drawdown[trough]), label(peak), label(trough)
+
+    def resample(self, column="Close", granularity="monthly", how="last"):
+        """
+        Aggregates a column into weekly (Monday-labelled), monthly or yearly periods of the
+        sorted date index, skipping missing values like SQL aggregates do. Returns (period labels, values).
+        """
+        import numpy as np
+        if granularity not in GRANULARITIES or how not in RESAMPLE_HOW:
+            raise ValueError(f"granularity must be one of {list(GRANULARITIES)} and how one of {RESAMPLE_HOW}.")
+        dates = self.dates
+        if dates is None:
+            raise ValueError(f"Snapshot '{self.meta['name']}' has no date index to resample.")
+        if granularity == "weekly":
+            # 1970-01-01 was a Thursday, so shifting by 3 days aligns weeks on Mondays
+            periods = ((dates.astype("datetime64[D]").astype(np.int64) + 3) // 7 * 7 - 3).astype("datetime64[D]")
+        else:
+            periods = dates.astype("datetime64[M]" if granularity == "monthly" else "datetime64[Y]")
+        starts = np.flatnonzero(np.concatenate(([True], periods[1:] != periods[:-1])))
+        values = self.column(column)
+        if how == "first":
+            result = values[starts]
+        elif how == "last":
+            result = values[np.append(starts[1:], len(values)) - 1]
+        elif how in ("min", "max"):
+            # fmin/fmax ignore NaN unless a whole period is missing
+            result = (np.fmin if how == "min" else np.fmax).reduceat(values, starts)
+        else:
+            present = ~np.isnan(values) if values.dtype.kind == "f" else np.ones(len(values), dtype=bool)
+            totals = np.add.reduceat(np.where(present, values, 0), starts)
+            result = totals if how == "sum" else totals / np.add.reduceat(present, starts)
+        return periods[starts], np.asarray(result)
+
+
+def run_snapshot(cred_json, db_index, out_dir, csv_dir=None):
+    """Snapshots the CSVs under `csv_dir`, or otherwise every table of a database, and prints what was written."""
+    if csv_dir:
+        written = snapshot_csv_tree(csv_dir, out_dir)
+    else:
+        chatdb = ChatDB(cred_json, db_index)
+        if not chatdb.conn:
+            return []
+        try:
+            written = snapshot_database(chatdb, out_dir)
+        finally:
+            chatdb.close_connection()
+    for path in written:
+        snapshot = Snapshot(path)
+        print(f"Snapshot '{path}': {len(snapshot)} rows, {len(snapshot.columns)} columns")
+    return written
@@ -0,0 +1,266 @@
+import base64
+import json
+import re
+import time
+
+from db_main.guard import LIMIT_REGEX
+
+# Internal tables share a prefix so the schema catalog can hide them from listings
+INTERNAL_TABLE_PREFIX = "_chatdb_"
+STATS_TABLE = "_chatdb_column_stats"
+SAMPLE_SIZE = 512
+
+WHERE_REGEX = re.compile(r"\bwhere\s+`?(\w+)`?\s*(=|!=|<=|>=|<|>)\s*('(?:[^']|'')*'|\?|%s|-?[\d.]+)", re.IGNORECASE)
+GROUP_BY_REGEX = re.compile(r"\bgroup\s+by\s+`?(\w+)`?", re.IGNORECASE)
+FROM_REGEX = re.compile(r"\bfrom\s+`?(\w+)`?", re.IGNORECASE)
+SINGLE_AGGREGATE_REGEX = re.compile(r"^\s*select\s+(?:sum|count|avg|min|max)\s*\([^)]*\)\s+from\b(?!.*\bgroup\s+by\b)",
+                                    re.IGNORECASE | re.DOTALL)
+
+
+def column_kind(sql_type):
+    """Maps a SQL data type to the kind its statistics are kept in."""
+    sql_type = (sql_type or "").lower()
+    return "number" if "int" in sql_type or sql_type in ("double", "float", "real", "decimal", "numeric") else "text"
+
+
+class HyperLogLog:
+    """Approximate distinct counter in 2**p one-byte registers (about 1.6% error at p=12)."""
+
+    def __init__(self, p=12, registers=None):
+        import numpy as np
+        self.p = p
+        self.registers = registers if registers is not None else np.zeros(1 << p, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        """Adds uniformly distributed 64-bit hashes: the top p bits pick a register, the low bits give the rank."""
+        import numpy as np
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        width = 53 - self.p  # Rank bits, kept below 2**53 so their float conversion is exact
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.intp)
+        rest = (hashes & np.uint64((1 << width) - 1)).astype(np.float64)
+        rank = (width + 1 - np.frexp(rest)[1]).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        """Folds another counter of the same precision into this one."""
+        import numpy as np
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        """Estimated number of distinct values, with linear counting for small cardinalities."""
+        import numpy as np
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int64))))
+        empty = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and empty:
+            estimate = m * np.log(m / empty)
+        return int(round(estimate))
+
+    def to_text(self):
+        """Registers as base64 text."""
+        return base64.b64encode(self.registers.tobytes()).decode("ascii")
+
+    @classmethod
+    def from_text(cls, text, p=12):
+        """Rebuilds a counter from `to_text` output."""
+        import numpy as np
+        return cls(p, np.frombuffer(base64.b64decode(text), dtype=np.uint8).copy())
+
+
+class ColumnStats:
+    """
+    Statistics of one column: row and null counts, min and max, a HyperLogLog distinct
+    count and a uniform sample of values for quantiles. Numbers are kept as numbers;
+    everything else, dates included, as text, which orders dates correctly.
+    """
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind  # "number" or "text"
+        self.rows = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.hll = HyperLogLog()
+        self.sample = []
+
+    def update(self, series, rng):
+        """Folds a chunk of values (a pandas Series) into the statistics in one vectorized pass."""
+        import pandas as pd
+        present = series.dropna()
+        seen = self.rows - self.nulls
+        self.rows += len(series)
+        self.nulls += len(series) - len(present)
+        if present.empty:
+            return
+        if self.kind == "number":
+            present = pd.to_numeric(present, errors="coerce").dropna().astype("float64")
+        else:
+            present = present.astype(str)
+        if present.empty:
+            return
+        low, high = present.min(), present.max()
+        low, high = (float(low), float(high)) if self.kind == "number" else (low, high)
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self.hll.add_hashes(pd.util.hash_pandas_object(present, index=False).to_numpy())
+        self._merge_sample(present.to_numpy(), seen, rng)
+
+    def _merge_sample(self, values, seen, rng):
+        """Keeps the sample uniform over every value seen: old and new values are drawn in proportion to their counts."""
+        total = seen + len(values)
+        if total <= SAMPLE_SIZE:
+            self.sample.extend(values.tolist())
+            return
+        from_chunk = min(len(values), round(SAMPLE_SIZE * len(values) / total))
+        from_sample = min(len(self.sample), SAMPLE_SIZE - from_chunk)
+        kept = rng.choice(len(self.sample), from_sample, replace=False) if from_sample < len(self.sample) else range(len(self.sample))
+        drawn = rng.choice(values, from_chunk, replace=False) if from_chunk < len(values) else values
+        self.sample = [self.sample[idx] for idx in kept] + drawn.tolist()
+
+    @property
+    def distinct(self):
+        """Approximate distinct non-null values, never more than the non-null rows."""
+        return min(self.hll.count(), self.rows - self.nulls)
+
+    def quantile(self, q):
+        """Approximate q-quantile (0 to 1) of the non-null values, or None for an empty column."""
+        if not self.sample:
+            return None
+        ordered = sorted(self.sample)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def coerce(self, value):
+        """Converts a value to the column's kind, or returns None when it cannot be compared."""
+        if self.kind == "text":
+            return str(value)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def estimate_rows(self, op, value):
+        """Estimated rows matching `column <op> value`, or None when the value does not fit the column."""
+        value = self.coerce(value)
+        present = self.rows - self.nulls
+        if value is None or not present:
+            return None if value is None else 0
+        if op in ("=", "!="):
+            matching = 0 if value < self.min or value > self.max else max(1, round(present / max(1, self.distinct)))
+            return matching if op == "=" else present - matching
+        below = sum(1 for sample in self.sample if sample < value) / len(self.sample)
+        return round(present * (below if op in ("<", "<=") else 1 - below))
+
+    def to_dict(self):
+        """JSON-serializable form, stored as the column's sketch."""
+        return {"kind": self.kind, "rows": self.rows, "nulls": self.nulls, "min": self.min, "max": self.max,
+                "hll": self.hll.to_text(), "sample": self.sample}
+
+    @classmethod
+    def from_dict(cls, name, data):
+        """Rebuilds column statistics from `to_dict` output."""
+        stats = cls(name, data["kind"])
+        stats.rows, stats.nulls, stats.min, stats.max = data["rows"], data["nulls"], data["min"], data["max"]
+        stats.hll = HyperLogLog.from_text(data["hll"])
+        stats.sample = data["sample"]
+        return stats
+
+
+class TableStats:
+    """Column statistics of one table, updated chunk by chunk as rows are loaded."""
+
+    def __init__(self, table_name, columns=None, seed=None):
+        import numpy as np
+        self.table_name = table_name
+        self.columns = columns or {}
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def rows(self):
+        """Rows seen so far."""
+        return max((stats.rows for stats in self.columns.values()), default=0)
+
+    def column(self, name):
+        """Returns a column's statistics, matching the name case-insensitively, or None."""
+        if name in self.columns:
+            return self.columns[name]
+        return next((stats for col, stats in self.columns.items() if col.lower() == name.lower()), None)
+
+    def update(self, frame):
+        """Folds a DataFrame chunk into the statistics; a column's kind is fixed by the first chunk it appears in."""
+        import pandas as pd
+        for col in frame.columns:
+            stats = self.columns.get(col)
+            if stats is None:
+                kind = "number" if pd.api.types.is_numeric_dtype(frame[col]) else "text"
+                stats = self.columns[col] = ColumnStats(col, kind)
+            stats.update(frame[col], self._rng)
+
+    def estimate_result_rows(self, sql_query, params=()):
+        """
+        Estimates how many rows a generated query returns: one for a single aggregate, the
+        distinct groups for GROUP BY, the matching rows for a single WHERE comparison,
+        otherwise the whole table, capped by a LIMIT. Returns None when a referenced column
+        has no statistics.
+        """
+        if SINGLE_AGGREGATE_REGEX.match(sql_query):
+            return 1
+        estimate = self.rows
+        where = WHERE_REGEX.search(sql_query)
+        if where:
+            stats = self.column(where.group(1))
+            literal = where.group(3)
+            if literal in ("?", "%s"):
+                literal = params[0] if params else None
+            elif literal.startswith("'"):
+                literal = literal[1:-1].replace("''", "'")
+            estimate = stats.estimate_rows(where.group(2), literal) if stats and literal is not None else None
+            if estimate is None:
+                return None
+        group = GROUP_BY_REGEX.search(sql_query)
+        if group:
+            stats = self.column(group.group(1))
+            if stats is None:
+                return None
+            estimate = min(estimate, stats.distinct + (1 if stats.nulls else 0))
+        limit = LIMIT_REGEX.search(sql_query.strip().rstrip(";"))
+        return min(estimate, int(limit.group(1))) if limit else estimate
+
+
+def stats_table_statement():
+    """Returns the CREATE statement of the statistics table, one row per (table, column)."""
+    return (f"CREATE TABLE IF NOT EXISTS `{STATS_TABLE}` (`table_name` VARCHAR(64) NOT NULL, "
+            "`column_name` VARCHAR(64) NOT NULL, `row_count` BIGINT, `null_count` BIGINT, `distinct_count` BIGINT, "
+            "`min_value` TEXT, `max_value` TEXT, `sketch` MEDIUMTEXT, `updated_at` VARCHAR(19), "
+            "PRIMARY KEY (`table_name`, `column_name`))")
+
+
+def save_table_stats(cursor, backend, stats):
+    """Replaces the stored statistics of a table; the caller commits."""
+    cursor.execute(stats_table_statement())
+    cursor.execute(f"DELETE FROM `{STATS_TABLE}` WHERE `table_name` = {backend.placeholder}", [stats.table_name])
+    columns = ["table_name", "column_name", "row_count", "null_count", "distinct_count", "min_value", "max_value",
+               "sketch", "updated_at"]
+    placeholders = ", ".join([backend.placeholder] * len(columns))
+    updated_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    cursor.executemany(
+        f"INSERT INTO `{STATS_TABLE}` ({', '.join(f'`{col}`' for col in columns)}) VALUES ({placeholders})",
+        [(stats.table_name, col.name, col.rows, col.nulls, col.distinct,
+          None if col.min is None else str(col.min), None if col.max is None else str(col.max),
+          json.dumps(col.to_dict()), updated_at) for col in stats.columns.values()],
+    )
+
+
+def load_table_stats(cursor, backend, table_name):
+    """Reads the stored statistics of a table, or returns None when it has none."""
+    cursor.execute(f"SELECT `column_name`, `sketch` FROM `{STATS_TABLE}` WHERE `table_name` = {backend.placeholder}",
+                   [table_name])
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    return TableStats(table_name, {col: ColumnStats.from_dict(col, json.loads(sketch)) for col, sketch in rows})
+
+
+def delete_table_stats(cursor, backend, table_name):
+    """Drops the stored statistics of a table; the caller commits."""
+    cursor.execute(f"DELETE FROM `{STATS_TABLE}` WHERE `table_name` = {backend.placeholder}", [table_name])
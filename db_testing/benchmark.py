@@ -0,0 +1,279 @@
+"""
+Reproducible performance benchmarks for ChatDB on the embedded SQLite backend.
+
+Run from the project root:
+
+    python -m db_testing.benchmark --output benchmark_results.json
+    python -m db_testing.benchmark --compare benchmark_results.json
+
+Results are written as JSON; with --compare, any metric that is worse than the
+baseline by more than the tolerance is reported and the exit code is 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from db_main.cache import ResultCache
+from db_main.db_setup import ChatDB, table_name_from_file
+from db_main.frames import frame_from_batches, frame_memory
+from db_main.resolver import ColumnResolver
+from db_testing.startup_benchmark import measure_import
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_ROOT, "data")
+
+# Metric name -> True when higher is better
+METRICS = {
+    "import_ms": False,
+    "upload_rows_per_sec": True,
+    "translate_questions_per_sec": True,
+    "execute_p50_ms": False,
+    "execute_p95_ms": False,
+    "result_frame_bytes": False,
+    "result_peak_bytes": False,
+}
+
+AGGREGATE_WORDS = ["total", "sum", "average", "mean", "max", "maximum", "min", "minimum", "count", "the number of"]
+COLUMN_TERMS = ["open", "high", "low", "close", "adj close", "volume", "price", "closing price", "vol", "date"]
+GROUP_TERMS = ["date", "volume", "month", "year", "week", "close"]
+QUERIES = [
+    "SELECT * FROM aapl WHERE Date BETWEEN '2019-01-01' AND '2019-12-31'",
+    "SELECT Date, Close FROM nvda ORDER BY Date DESC LIMIT 20",
+    "SELECT AVG(Close) FROM aapl",
+    "SELECT MAX(High), MIN(Low) FROM amzn",
+    "SELECT COUNT(*) FROM goog WHERE Volume > 1000000",
+]
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silences ChatDB's console output while timing."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def local_chatdb(tmp_dir):
+    """Connects a ChatDB to a fresh in-memory SQLite database."""
+    cred_json = os.path.join(tmp_dir, "bench_cred.json")
+    with open(cred_json, "w") as file:
+        json.dump({"db_cred": [{"name": "bench", "backend": "sqlite", "path": ":memory:"}]}, file)
+    with quiet():
+        chatdb = ChatDB(cred_json, 0, result_cache=ResultCache(max_bytes=0))
+    chatdb.debug = False
+    return chatdb
+
+
+def bundled_csvs(subdirs):
+    """Returns the CSV paths under the given data/ subdirectories."""
+    paths = []
+    for subdir in subdirs:
+        directory = os.path.join(DATA_DIR, subdir)
+        paths += [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".csv")]
+    return paths
+
+
+def bench_upload(chatdb, csv_paths):
+    """Uploads every CSV and returns rows/sec over all of them."""
+    rows = 0
+    start = time.perf_counter()
+    with quiet():
+        for path in csv_paths:
+            chatdb.upload_dataset(path, table_name_from_file(path), if_exists="overwrite")
+    elapsed = time.perf_counter() - start
+    cursor = chatdb.conn.cursor()
+    for path in csv_paths:
+        cursor.execute(f"SELECT COUNT(*) FROM `{table_name_from_file(path)}`")
+        rows += cursor.fetchone()[0]
+    return {"upload_rows": rows, "upload_seconds": round(elapsed, 4), "upload_rows_per_sec": round(rows / elapsed, 1)}
+
+
+def question_corpus(size, seed=7):
+    """Generates a deterministic corpus of aggregate and filter questions."""
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(size):
+        if rng.random() < 0.8:
+            questions.append(f"{rng.choice(AGGREGATE_WORDS)} {rng.choice(COLUMN_TERMS)} by {rng.choice(GROUP_TERMS)}")
+        else:
+            questions.append(f"find {rng.choice(COLUMN_TERMS)} where {rng.choice(COLUMN_TERMS)} is {rng.randint(1, 500)}")
+    return questions
+
+
+def bench_translate(chatdb, table_name, size):
+    """Translates a generated corpus and returns questions/sec."""
+    columns = chatdb.catalog.columns(table_name)
+    questions = question_corpus(size)
+    start = time.perf_counter()
+    for question in questions:
+        chatdb.natural_language_to_sql(question, table_name, columns)
+    elapsed = time.perf_counter() - start
+    return {"translate_questions": size, "translate_questions_per_sec": round(size / elapsed, 1)}
+
+
+def bench_resolver(column_counts, lookups=2000, seed=11):
+    """Measures cold and warm column resolution latency for tables of increasing width."""
+    rng = random.Random(seed)
+    results = {}
+    for count in column_counts:
+        columns = ["Date", "Open", "High", "Low", "Close", "Adj Close", "Volume"]
+        columns += [f"metric_{idx}_{rng.choice(['avg', 'max', 'ratio', 'score'])}" for idx in range(count - len(columns))]
+        terms = [rng.choice(["close", "adj", "price", "volume", f"metric {rng.randrange(count)}", "clse", "opn"])
+                 for _ in range(lookups)]
+        resolver = ColumnResolver(columns, cache_size=0)
+        start = time.perf_counter()
+        for term in terms:
+            resolver.resolve(term)
+        cold = (time.perf_counter() - start) / lookups
+        resolver = ColumnResolver(columns)
+        for term in terms:
+            resolver.resolve(term)
+        start = time.perf_counter()
+        for term in terms:
+            resolver.resolve(term)
+        warm = (time.perf_counter() - start) / lookups
+        results[str(count)] = {"cold_us": round(cold * 1e6, 2), "warm_us": round(warm * 1e6, 3)}
+    return {"resolver_latency": results}
+
+
+def bench_execute(chatdb, repeats):
+    """Runs a fixed query set through execute_query and returns latency percentiles."""
+    timings = []
+    with quiet():
+        for _ in range(repeats):
+            for query in QUERIES:
+                start = time.perf_counter()
+                chatdb.execute_query(query, stream=False)
+                timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "execute_queries": len(timings),
+        "execute_p50_ms": round(statistics.median(timings), 3),
+        "execute_p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+    }
+
+
+def _peak_allocation(build):
+    """Returns (result of build(), peak bytes allocated while building it)."""
+    tracemalloc.start()
+    try:
+        result = build()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(chatdb, table_name):
+    """
+    Compares fetching a whole table into a plain DataFrame against the compact build fed
+    straight from cursor batches (bytes held, and peak allocated including the fetch).
+    """
+    import pandas as pd
+
+    def plain_build():
+        cursor = chatdb.conn.cursor()
+        cursor.execute(f"SELECT * FROM `{table_name}`")
+        return pd.DataFrame(cursor.fetchall(), columns=[desc[0] for desc in cursor.description])
+
+    def compact_build():
+        cursor = chatdb.conn.cursor()
+        cursor.execute(f"SELECT * FROM `{table_name}`")
+        columns = [desc[0] for desc in cursor.description]
+        return frame_from_batches(chatdb._fetch_batches(cursor, 1000, None), columns, compact=True)
+
+    plain, plain_peak = _peak_allocation(plain_build)
+    compact, compact_peak = _peak_allocation(compact_build)
+    return {
+        "result_rows": len(compact),
+        "result_frame_bytes_plain": frame_memory(plain),
+        "result_frame_bytes": frame_memory(compact),
+        "result_peak_bytes_plain": plain_peak,
+        "result_peak_bytes": compact_peak,
+    }
+
+
+def git_commit():
+    """Returns the current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Runs every benchmark and returns the results document."""
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus_size": args.corpus_size,
+        }
+    }
+    import_seconds, _ = measure_import()
+    results["import_ms"] = round(import_seconds * 1000, 2)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        chatdb = local_chatdb(tmp_dir)
+        try:
+            results.update(bench_upload(chatdb, bundled_csvs(["stock_mag7", "etf_indexes", "etf_biotech_top3"])))
+            results.update(bench_translate(chatdb, "aapl", args.corpus_size))
+            results.update(bench_resolver([10, 100, 1000]))
+            results.update(bench_execute(chatdb, args.repeats))
+            with quiet():
+                chatdb.sync_fact_table()
+            results.update(bench_memory(chatdb, "prices"))
+        finally:
+            with quiet():
+                chatdb.close_connection()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns human-readable regressions of `results` against `baseline`."""
+    regressions = []
+    for metric, higher_is_better in METRICS.items():
+        old, new = baseline.get(metric), results.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ChatDB performance benchmarks")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against a previous results file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default 0.2)")
+    parser.add_argument("--corpus-size", type=int, default=20000, help="Number of generated questions")
+    parser.add_argument("--repeats", type=int, default=20, help="Repetitions of the execute query set")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Import-time budget for db_main.db_setup, in seconds (median over fresh interpreters)
+IMPORT_BUDGET = 0.1
+RUNS = 7
+
+# Modules that must only be loaded on first use, never at import time
+LAZY_MODULES = ["pandas", "pymysql", "nltk", "numpy", "difflib"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import db_main.db_setup
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def measure_import(runs=RUNS):
+    """Imports db_main.db_setup in fresh interpreters and returns (median seconds, eagerly loaded modules)."""
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings, loaded = [], set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=repo_root, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+        loaded.update(result["loaded"])
+    return statistics.median(timings), sorted(loaded)
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else IMPORT_BUDGET
+    seconds, loaded = measure_import()
+    print(f"Import time of db_main.db_setup: {seconds * 1000:.1f} ms (budget {budget * 1000:.0f} ms)")
+    if loaded:
+        print(f"FAIL: heavy modules loaded at import time: {', '.join(loaded)}")
+        return 1
+    if seconds > budget:
+        print("FAIL: import-time budget exceeded")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())